@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+    This file is part of dash_encoder.
+    dash_encoder is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    dash_encoder is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with dash_encoder. If not, see <http://www.gnu.org/licenses/>.
+
+    Author: Steve Göring
+"""
+import argparse
+import sys
+import os
+import json
+import time
+import subprocess
+
+import dash_encoder
+
+"""
+reproducible benchmark of the encoding pipeline,
+all test videos are generated with ffmpeg's lavfi sources, so no external videos are required
+"""
+
+# lavfi sources with increasing complexity for the encoder
+SOURCES = {
+    "testsrc2": "testsrc2=size={width}x{height}:rate=25",
+    "mandelbrot": "mandelbrot=size={width}x{height}:rate=25",
+    "noise": "testsrc2=size={width}x{height}:rate=25,noise=alls=40:allf=t+u:all_seed=42",
+}
+
+
+def generate_source(folder, source, height, duration):
+    """
+    Create a deterministic test video, existing videos are reused.
+    @return video file
+    """
+    width = 2 * int(round(height * 16 / 9 / 2))
+    video = os.path.join(folder, f"{source}_{height}p_{duration}s.mp4")
+    if os.path.isfile(video):
+        return video
+    lavfi = SOURCES[source].format(width=width, height=height)
+    cmd = f"""
+        {dash_encoder.ffmpeg()} -y -hide_banner -v error
+        -f lavfi -i "{lavfi}"
+        -f lavfi -i "sine=frequency=1000:sample_rate=48000"
+        -t {duration}
+        -c:v libx264 -preset ultrafast -qp 0 -pix_fmt yuv420p
+        -c:a aac -b:a 192k
+        "{video}" """
+    print(f"generate {video}")
+    subprocess.check_call(" ".join(cmd.split()), shell=True)
+    return video
+
+
+def run_case(video, mode, jobs, folder):
+    """
+    Run the full encoding pipeline for `video` and collect the results from the encoding report.
+    """
+    name = os.path.splitext(os.path.basename(video))[0]
+    dash_folder = os.path.join(folder, f"{mode}_j{jobs}")
+    log_file = os.path.join(folder, f"{name}_{mode}_j{jobs}.log")
+    cmd = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "dash_encoder.py"),
+        video,
+        "--dash_folder", dash_folder,
+        "--auto_subfolders",
+        "--encoding_mode", mode,
+        "--jobs", str(jobs),
+        "--force",
+        "--no_progress"
+    ]
+    print(f"run {name} with {mode} mode and {jobs} jobs")
+    start = time.time()
+    with open(log_file, "w") as lfp:
+        returncode = subprocess.call(cmd, stdout=lfp, stderr=subprocess.STDOUT)
+    wall_time = time.time() - start
+    if returncode != 0:
+        print(f"{name} failed, see {log_file}")
+        return {"returncode": returncode}
+
+    with open(os.path.join(dash_folder, name, name + "_report.json")) as rfp:
+        report = json.load(rfp)
+    meta = dash_encoder.probe(video)
+    frames = meta["duration"] * dash_encoder.Fraction(meta["fps"])
+    encode_time = report["stages"]["encode"]["wall_time"]
+    return {
+        "returncode": returncode,
+        "wall_time": wall_time,
+        "encode_time": encode_time,
+        "fps": float(frames / encode_time) if encode_time > 0 else None,
+        "realtime_factor": report["realtime_factor"],
+        "cpu_time": report["total"]["cpu_time"],
+        "peak_rss_kb": report["total"]["peak_rss_kb"],
+        "bitrate": sum(x.get("bitrate", 0) for k, x in report["renditions"].items() if k != "audio"),
+        "bytes_written": report["bytes_written"]
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare the results with a baseline.
+    @return list of regressions
+    """
+    # metric, True if higher values are better
+    metrics = [("realtime_factor", True), ("fps", True), ("peak_rss_kb", False), ("bitrate", False)]
+    regressions = []
+    for case, values in sorted(results.items()):
+        if case not in baseline or values.get("returncode") != 0:
+            continue
+        for metric, higher_is_better in metrics:
+            old = baseline[case].get(metric)
+            new = values.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (higher_is_better and change < -threshold) or (not higher_is_better and change > threshold):
+                regressions.append(f"{case}: {metric} changed from {old:.2f} to {new:.2f} ({100 * change:+.1f}%)")
+    return regressions
+
+
+def main(args):
+    # argument parsing
+    parser = argparse.ArgumentParser(description='benchmark of the dash encoding pipeline',
+                                     epilog="stg7 2019",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--folder", type=str, default="benchmark", help="folder for test videos and encodings")
+    parser.add_argument("--sources", type=str, nargs="+", default=list(SOURCES.keys()), choices=list(SOURCES.keys()), help="test video sources")
+    parser.add_argument("--heights", type=int, nargs="+", default=[360, 1080], help="resolutions of the test videos")
+    parser.add_argument("--durations", type=int, nargs="+", default=[10], help="durations of the test videos in seconds")
+    parser.add_argument("--modes", type=str, nargs="+", default=["rendition", "single_decode", "chunked", "direct"], help="encoding modes to benchmark")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, os.cpu_count()], help="number of parallel jobs to benchmark")
+    parser.add_argument("--history", type=str, default="benchmark_history.json", help="json file where all benchmark runs are appended")
+    parser.add_argument("--baseline", type=str, default="benchmark_baseline.json", help="json file with baseline results")
+    parser.add_argument("--update_baseline", action="store_true", help="store the results as new baseline")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change that is considered as regression")
+
+    a = vars(parser.parse_args(args))
+    print(f"used cli parmeters: {a}")
+    os.makedirs(a["folder"], exist_ok=True)
+
+    results = {}
+    for source in a["sources"]:
+        for height in a["heights"]:
+            for duration in a["durations"]:
+                video = generate_source(a["folder"], source, height, duration)
+                for mode in a["modes"]:
+                    for jobs in sorted(set(a["jobs"])):
+                        case = f"{source}_{height}p_{duration}s_{mode}_j{jobs}"
+                        results[case] = run_case(video, mode, jobs, a["folder"])
+                        print(f"{case}: {results[case]}")
+
+    history = []
+    if os.path.isfile(a["history"]):
+        with open(a["history"]) as hfp:
+            history = json.load(hfp)
+    history.append({
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "encoder": dash_encoder.encoder_version(),
+        "cpus": os.cpu_count(),
+        "results": results
+    })
+    with open(a["history"], "w") as hfp:
+        json.dump(history, hfp, indent=4)
+    print(f"results appended to {a['history']}")
+
+    if a["update_baseline"]:
+        with open(a["baseline"], "w") as bfp:
+            json.dump(results, bfp, indent=4, sort_keys=True)
+        print(f"baseline stored in {a['baseline']}")
+        return
+
+    if not os.path.isfile(a["baseline"]):
+        print(f"there is no baseline {a['baseline']}, use --update_baseline to create one")
+        return
+
+    with open(a["baseline"]) as bfp:
+        baseline = json.load(bfp)
+    regressions = compare(results, baseline, a["threshold"])
+    failed = [case for case, values in results.items() if values.get("returncode") != 0]
+    for regression in regressions:
+        print(f"regression: {regression}")
+    for case in failed:
+        print(f"failed: {case}")
+    if regressions or failed:
+        return 1
+    print("no regressions :-)")
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
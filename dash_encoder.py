@@ -21,6 +21,18 @@ import os
 import glob
 import subprocess
 import shutil
+import time
+import json
+import hashlib
+import functools
+import threading
+import heapq
+import itertools
+import queue
+import re
+from xml.etree import ElementTree
+from fractions import Fraction
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 """
 based on:
@@ -31,12 +43,13 @@ based on:
     * nice post about encoding: https://developers.google.com/media/vp9/settings/vod/
 """
 
+@functools.lru_cache()
 def get_local_executable(path, executable):
-    executable = list(glob.glob(os.path.join(path, executable)))
-    if len(executable) == 0:
+    local_executable = list(glob.glob(os.path.join(path, executable)))
+    if len(local_executable) == 0:
         return shutil.which(executable)  # use system's executable
-    assert len(executable) == 1
-    return executable[0]
+    assert len(local_executable) == 1
+    return local_executable[0]
 
 
 def ffmpeg():
@@ -60,67 +73,435 @@ def shell_call(call):
     return output
 
 
-def get_fps(video):
-    cmd = f"""{ffprobe()} -v 0 -of csv=p=0 -select_streams v:0 -show_entries stream=r_frame_rate {video}"""
-    fps = shell_call(cmd).split("\n")[0]
-    fps = fps.split("/")
-    if len(fps) > 1:
-        fps = int(math.ceil(int(fps[0].strip()) / int(fps[1].strip())))
-        return fps
-    return int(fps[0])
-
-
-def build_video_encode_command(video, dashdir, height=240, seg_duration=2):
-    # TODO: currently only CRF encoding possible
-    # notes for other codecs
-    #    -an -c:v libaom-av1 -row-mt 1
-    #    -crf 30 -b:v 0 -strict experimental
-    #    -cpu-used 4
-    #    -preset slow
-    #    -an -c:v libx265
-    #    -crf 28
-    #-x265-params "keyint=25:min-keyint=25"
-    #-tune film -x264opts 'keyint=25:min-keyint=25:no-scenecut'
-    # -x264opts 'keyint=25:min-keyint=25:no-scenecut'
-    encoding = {
+def file_hash(filename, blocksize=2**20):
+    """
+    sha256 hex digest of the content of `filename`.
+    """
+    h = hashlib.sha256()
+    with open(filename, "rb") as fp:
+        for block in iter(lambda: fp.read(blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# in-process memo of probe results, key is (absolute path, size, mtime)
+_probe_cache = {}
+
+
+def run_probe(video):
+    """
+    Collect streams, frame rate, duration, dimensions, keyframe positions and
+    audio layout of `video`, keyframes are read in a second ffprobe call that only reads the video packets.
+    """
+    cmd = f"""{ffprobe()} -v error -print_format json -show_format -show_streams "{video}" """
+    try:
+        info = json.loads(shell_call(cmd))
+    except ValueError:
+        # ffprobe failed and printed only an error message
+        info = {}
+    video_streams = [s for s in info.get("streams", []) if s.get("codec_type") == "video"]
+    audio_streams = [s for s in info.get("streams", []) if s.get("codec_type") == "audio"]
+    if len(video_streams) == 0 or "format" not in info:
+        raise RuntimeError(f"{video} can not be probed or does not contain a video stream")
+    v = video_streams[0]
+    # one line per packet of the first video stream: pts_time,flags
+    cmd = f"""{ffprobe()} -v error -select_streams v:0 -show_entries packet=pts_time,flags -of csv=print_section=0 "{video}" """
+    keyframes = []
+    for line in shell_call(cmd).split("\n"):
+        parts = line.strip().split(",")
+        if len(parts) >= 2 and "K" in parts[1] and parts[0] not in ["", "N/A"]:
+            keyframes.append(float(parts[0]))
+    audio = None
+    if audio_streams:
+        audio = {
+            "codec": audio_streams[0].get("codec_name"),
+            "channels": audio_streams[0].get("channels"),
+            "channel_layout": audio_streams[0].get("channel_layout"),
+            "sample_rate": int(audio_streams[0].get("sample_rate", 0))
+        }
+    return {
+        "streams": info["streams"],
+        "fps": v["r_frame_rate"],  # exact rational frame rate, e.g. "30000/1001"
+        "duration": float(info["format"].get("duration", v.get("duration", 0))),
+        "width": v["width"],
+        "height": v["height"],
+        "keyframes": sorted(keyframes),
+        "audio": audio
+    }
+
+
+def probe(video, sidecar=None):
+    """
+    Probe `video` once and reuse the result.
+    Results are memoized in-process and, if `sidecar` is given, stored as json file.
+    A sidecar is reused if size and mtime of the video are unchanged,
+    or if only the mtime changed but the content hash is still the same.
+    @param video video file to probe
+    @param sidecar optional json file for persisting the probe result
+    @return dict with metadata of the video, see `run_probe`
+    """
+    stat = os.stat(video)
+    key = (os.path.abspath(video), stat.st_size, stat.st_mtime)
+    if key in _probe_cache:
+        return _probe_cache[key]
+
+    meta = None
+    if sidecar and os.path.isfile(sidecar):
+        with open(sidecar) as sfp:
+            cached = json.load(sfp)
+        if cached.get("size") == stat.st_size and cached.get("mtime") == stat.st_mtime:
+            meta = cached
+        elif cached.get("size") == stat.st_size and cached.get("hash") == file_hash(video):
+            meta = cached
+            meta["mtime"] = stat.st_mtime
+            print(f"{video} was touched, but content is unchanged")
+        if meta is not None:
+            print(f"reuse probe results of {sidecar}")
+
+    if meta is None:
+        print(f"probe {video}")
+        meta = run_probe(video)
+        meta["size"] = stat.st_size
+        meta["mtime"] = stat.st_mtime
+        meta["hash"] = file_hash(video)
+    if sidecar:
+        with open(sidecar, "w") as sfp:
+            json.dump(meta, sfp)
+    _probe_cache[key] = meta
+    return meta
+
+
+# video codecs, with the supported encoders in order of preference
+CODECS = {
+    "h264": ["libx264"],
+    "hevc": ["libx265"],
+    "vp9": ["libvpx-vp9"],
+    "av1": ["libsvtav1", "libaom-av1"],
+}
+# relative encoding time compared to h264, used for scheduling
+CODEC_COST = {"h264": 1, "hevc": 4, "vp9": 3, "av1": 6}
+
+# settings per encoder and height, lower renditions are cheap, so they use slower presets
+# to compensate the lower resolution, other heights use the `None` settings
+ENCODER_SETTINGS = {
+    "libx264": {
         240: {"crf": 32, "preset": "medium"},
-        360: {"crf": 32, "preset": "medium"},  # compensate lower resolution with better preset
+        360: {"crf": 32, "preset": "medium"},
         576: {"crf": 28, "preset": "medium"},
         720: {"crf": 24, "preset": "fast"},
-        1080: {"crf": 24, "preset": "fast"}
-    }
-    output = os.path.join(dashdir, os.path.splitext(os.path.basename(video))[0] + f"_{height}p.mp4")
-    fps = get_fps(video)
-    crf = 24
-    preset = "slow"
-    if height in encoding:
-        crf = encoding[height]["crf"]
-        preset = encoding[height]["preset"]
+        1080: {"crf": 24, "preset": "fast"},
+        None: {"crf": 24, "preset": "slow"},
+    },
+    "libx265": {
+        240: {"crf": 34, "preset": "medium"},
+        360: {"crf": 34, "preset": "medium"},
+        576: {"crf": 31, "preset": "medium"},
+        720: {"crf": 28, "preset": "fast"},
+        1080: {"crf": 28, "preset": "fast"},
+        None: {"crf": 28, "preset": "medium"},
+    },
+    # cpu-used: 0 (slowest) - 8, tile-columns: log2 of the number of tile columns
+    "libvpx-vp9": {
+        240: {"crf": 40, "cpu-used": 2, "tile-columns": 0},
+        360: {"crf": 38, "cpu-used": 2, "tile-columns": 1},
+        576: {"crf": 35, "cpu-used": 3, "tile-columns": 1},
+        720: {"crf": 33, "cpu-used": 4, "tile-columns": 2},
+        1080: {"crf": 32, "cpu-used": 4, "tile-columns": 2},
+        None: {"crf": 32, "cpu-used": 4, "tile-columns": 3},
+    },
+    # cpu-used: 0 (slowest) - 8, tiles: columns x rows
+    "libaom-av1": {
+        240: {"crf": 40, "cpu-used": 4, "tiles": "1x1"},
+        360: {"crf": 38, "cpu-used": 4, "tiles": "2x1"},
+        576: {"crf": 36, "cpu-used": 5, "tiles": "2x1"},
+        720: {"crf": 34, "cpu-used": 6, "tiles": "2x2"},
+        1080: {"crf": 33, "cpu-used": 6, "tiles": "2x2"},
+        None: {"crf": 33, "cpu-used": 6, "tiles": "4x2"},
+    },
+    # preset: 0 (slowest) - 13, tile-columns: log2 of the number of tile columns
+    "libsvtav1": {
+        240: {"crf": 40, "preset": 8, "tile-columns": 0},
+        360: {"crf": 38, "preset": 8, "tile-columns": 0},
+        576: {"crf": 36, "preset": 9, "tile-columns": 1},
+        720: {"crf": 34, "preset": 10, "tile-columns": 1},
+        1080: {"crf": 33, "preset": 10, "tile-columns": 2},
+        None: {"crf": 33, "preset": 10, "tile-columns": 2},
+    },
+}
+
+
+@functools.lru_cache()
+def available_encoders():
+    encoders = set()
+    for line in shell_call(f"{ffmpeg()} -hide_banner -encoders").split("\n"):
+        parts = line.split()
+        if len(parts) >= 2 and parts[0].startswith("V"):
+            encoders.add(parts[1])
+    return encoders
+
+
+# options of `encoder_parameters` that are no private options of the encoder
+GENERIC_OPTIONS = {"c", "b", "tag"}
+
+
+@functools.lru_cache()
+def encoder_options(encoder):
+    """
+    Private options of `encoder` in the used ffmpeg, e.g. libsvtav1 has no crf before ffmpeg 5.
+    """
+    options = set()
+    for line in shell_call(f"{ffmpeg()} -hide_banner -h encoder={encoder}").split("\n"):
+        # option lines are indented by two spaces, values of an option by more
+        if line.startswith("  -"):
+            options.add(line.split()[0][1:])
+    return options
+
+
+@functools.lru_cache()
+def codec_encoder(codec):
+    """
+    Preferred encoder of `codec` that is available in the used ffmpeg and supports all options of `encoder_parameters`.
+    """
+    available = available_encoders()
+    for encoder in CODECS[codec]:
+        if encoder not in available:
+            continue
+        required = {option for option, _ in encoder_parameters(encoder, ENCODER_SETTINGS[encoder][None], 1)} - GENERIC_OPTIONS
+        missing = required - encoder_options(encoder)
+        if not missing:
+            return encoder
+        print(f"{encoder} of the used ffmpeg does not support {', '.join(sorted(missing))}, it is not used")
+    raise RuntimeError(f"ffmpeg has no usable encoder for {codec}, one of {CODECS[codec]} is required")
+
+
+def rendition_name(height, codec="h264"):
+    return f"{height}p" if codec == "h264" else f"{height}p_{codec}"
+
+
+def encoder_parameters(encoder, settings, keyint):
+    """
+    Encoder specific options for one rendition as list of (option, value),
+    keyframes are placed exactly every `keyint` frames, without additional keyframes at scene cuts.
+    """
+    maxrate = settings.get("maxrate")
+    if encoder == "libx264":
+        return [
+            ("preset", settings["preset"]), ("c", encoder), ("crf", settings["crf"]),
+            ("x264opts", f"'keyint={keyint}:min-keyint={keyint}:no-scenecut'"),
+        ]
+    if encoder == "libx265":
+        return [
+            ("preset", settings["preset"]), ("c", encoder), ("crf", settings["crf"]),
+            ("x265-params", f"'keyint={keyint}:min-keyint={keyint}:scenecut=0:open-gop=0:log-level=error'"),
+            # required by some players for hevc in mp4
+            ("tag", "hvc1"),
+        ]
+    if encoder == "libvpx-vp9":
+        # with a target bitrate crf becomes constrained quality
+        return [
+            ("c", encoder), ("crf", settings["crf"]), ("b", f"{maxrate}k" if maxrate else 0),
+            ("deadline", "good"), ("cpu-used", settings["cpu-used"]),
+            ("row-mt", 1), ("tile-columns", settings["tile-columns"]), ("frame-parallel", 0),
+        ]
+    if encoder == "libaom-av1":
+        return [
+            ("c", encoder), ("crf", settings["crf"]), ("b", f"{maxrate}k" if maxrate else 0),
+            ("cpu-used", settings["cpu-used"]), ("row-mt", 1), ("tiles", settings["tiles"]),
+        ]
+    if encoder == "libsvtav1":
+        return [
+            ("c", encoder), ("crf", settings["crf"]), ("preset", settings["preset"]),
+            ("svtav1-params", f"'tile-columns={settings['tile-columns']}:scd=0'"),
+        ]
+    raise ValueError(f"unknown encoder {encoder}")
 
+
+def video_encode_options(video, height=240, seg_duration=2, stream=None, overrides=None, codec="h264"):
+    """
+    ffmpeg output options for encoding one rendition of `video`, without input and scaling.
+    If several renditions are written to the same output, `stream` is the index of the
+    output video stream the options are applied to.
+    `overrides` optionally replaces the default settings, mapping height -> {"crf": .., "preset": ..},
+    crf and preset values are h264 values and only used for h264, maxrate and bufsize are used for all codecs.
+    """
+    encoder = codec_encoder(codec)
+    settings = dict(ENCODER_SETTINGS[encoder].get(height, ENCODER_SETTINGS[encoder][None]))
+    for key, value in ((overrides or {}).get(height) or {}).items():
+        if codec == "h264" or key not in ["crf", "preset"]:
+            settings[key] = value
+
+    # keyframe distance in frames for one segment, based on the exact frame rate
+    keyint = int(math.ceil(seg_duration * Fraction(probe(video)["fps"])))
+    parameters = encoder_parameters(encoder, settings, keyint)
+    # capped crf: the vbv limits the bitrate peaks of the crf encoding
+    if "maxrate" in settings:
+        parameters += [("maxrate", f"{settings['maxrate']}k"), ("bufsize", f"{settings['bufsize']}k")]
+    parameters += [("g", keyint), ("keyint_min", keyint), ("pix_fmt", "yuv420p")]
+
+    spec = f":v:{stream}" if stream is not None else ":v"
+    options = " ".join(f"-{option}{spec} {value}" for option, value in parameters)
+    if stream is None:
+        options = "-an " + options
+    return options
+
+
+# maximum bitrates in kbit/s per height for capped crf encoding
+TARGET_BITRATES = {240: 400, 360: 800, 576: 1800, 720: 3000, 1080: 6000}
+
+
+def target_bitrate(height, bitrates=TARGET_BITRATES):
+    """
+    Maximum bitrate in kbit/s for `height`, bitrates of heights that are not part of `bitrates`
+    are interpolated (or extrapolated) based on the number of pixels.
+    """
+    if height in bitrates:
+        return bitrates[height]
+    heights = sorted(bitrates)
+    lower = max([h for h in heights if h < height], default=heights[0])
+    upper = min([h for h in heights if h > height], default=heights[-1])
+    if lower == upper:
+        return int(bitrates[lower] * height ** 2 / lower ** 2)
+    weight = (height ** 2 - lower ** 2) / (upper ** 2 - lower ** 2)
+    return int(bitrates[lower] + weight * (bitrates[upper] - bitrates[lower]))
+
+
+def scale_filter(video, height):
+    """
+    ffmpeg scale filter for a rendition, `height` is the length of the short side,
+    so that portrait videos are handled in the same way as landscape videos.
+    """
+    meta = probe(video)
+    if meta["height"] > meta["width"]:
+        return f"scale={height}:-2"
+    return f"scale=-2:{height}"
+
+
+RESOLUTIONS = [240, 360, 576, 720, 1080] #, 540, 720, 1080] #, 1440, 2160]  # TODO: extend, check, update
+
+
+def build_ladder(video, resolutions, policy="drop", native_top=False):
+    """
+    Select the renditions of `resolutions` that fit to the probed source video,
+    renditions above the source resolution are not useful, because they are just upscaled.
+    @param video source video
+    @param resolutions all possible rungs of the ladder (short side of the video)
+    @param policy drop: remove renditions above the source, cap: replace them by one rendition in source resolution
+    @param native_top add the source resolution as top rendition, if it is not part of the ladder
+    @return sorted list of heights
+    """
+    meta = probe(video)
+    source = min(meta["width"], meta["height"])
+    source = source - source % 2  # encoders need even dimensions
+    ladder = [r for r in resolutions if r <= source]
+    if policy == "cap" and len(ladder) < len(resolutions):
+        ladder.append(source)
+    if native_top or len(ladder) == 0:
+        ladder.append(source)
+    ladder = sorted(set(ladder))
+    dropped = [r for r in resolutions if r not in ladder]
+    if dropped:
+        print(f"source has {meta['width']}x{meta['height']}, skip renditions {dropped}")
+    return ladder
+
+
+def video_output(video, dashdir, height, codec="h264"):
+    return os.path.join(dashdir, os.path.splitext(os.path.basename(video))[0] + f"_{rendition_name(height, codec)}.mp4")
+
+
+def build_video_encode_command(video, dashdir, height=240, seg_duration=2, overrides=None, codec="h264"):
+    output = video_output(video, dashdir, height, codec)
     cmd = f"""
         {ffmpeg()} -y -hide_banner
         -i "{video}"
-        -preset {preset}
-        -an -c:v libx264
-        -crf {crf}
-        -x264opts 'keyint={seg_duration*fps}:min-keyint={seg_duration*fps}:no-scenecut'
-        -g {seg_duration}
-        -pix_fmt yuv420p
-        -vf "scale=-2:{height}"
+        {video_encode_options(video, height, seg_duration, overrides=overrides, codec=codec)}
+        -vf "{scale_filter(video, height)}"
         -f mp4
         "{output}" """
     cmd = " ".join(cmd.split())
     return cmd, output
 
 
+def chunk_boundaries(video, seg_duration=2, chunk_duration=60):
+    """
+    Split `video` into chunks for parallel encoding.
+    Every chunk starts at a multiple of the keyframe interval of one segment, so the
+    closed GOP structure is the same as for an encoding of the full video,
+    if possible chunk starts are moved to keyframes of the source video, to avoid decoding unused frames.
+    @return list of (first frame, number of frames) for each chunk
+    """
+    meta = probe(video)
+    fps = Fraction(meta["fps"])
+    keyint = int(math.ceil(seg_duration * fps))
+    total_frames = int(round(meta["duration"] * fps))
+    step = max(1, int(round(chunk_duration / seg_duration))) * keyint
+    source_keyframes = {int(round(k * fps)) for k in meta["keyframes"]}
+
+    starts = [0]
+    while starts[-1] + step + keyint < total_frames:
+        target = starts[-1] + step
+        # segment boundaries close to the target position, that are also source keyframes
+        candidates = [
+            target + i * keyint for i in range(-((step // keyint) // 4), (step // keyint) // 4 + 1)
+            if target + i * keyint in source_keyframes
+        ]
+        starts.append(min(candidates, key=lambda x: abs(x - target)) if candidates else target)
+    ends = starts[1:] + [total_frames]
+    return [(start, end - start) for start, end in zip(starts, ends)]
+
+
+def build_chunked_video_encode_commands(video, dashdir, height=240, seg_duration=2, chunk_duration=60, overrides=None, codec="h264"):
+    """
+    Encode one rendition in independent chunks, that are losslessly concatenated afterwards.
+    Nothing is written here, the chunk folder and the concat list are created when the jobs start, see `run_job`.
+    @return list of (cmd, chunk file, chunk duration) for all chunks, concat cmd, output file,
+        dict with the concat list file and its content
+    """
+    output = video_output(video, dashdir, height, codec)
+    chunkdir = os.path.splitext(output)[0] + "_chunks"
+    fps = Fraction(probe(video)["fps"])
+
+    chunk_cmds = []
+    for i, (start, frames) in enumerate(chunk_boundaries(video, seg_duration, chunk_duration)):
+        chunk = os.path.join(chunkdir, f"{i:05d}.mp4")
+        # seek half a frame before the first frame of the chunk, to be robust against rounding
+        start_time = float(max(0, (start - Fraction(1, 2)) / fps))
+        cmd = f"""
+            {ffmpeg()} -y -hide_banner
+            -ss {start_time:.6f}
+            -i "{video}"
+            -frames:v {frames}
+            {video_encode_options(video, height, seg_duration, overrides=overrides, codec=codec)}
+            -vf "{scale_filter(video, height)}"
+            -f mp4
+            "{chunk}" """
+        chunk_cmds.append((" ".join(cmd.split()), chunk, float(frames / fps)))
+
+    concat_list = os.path.join(chunkdir, "concat.txt")
+    files = {concat_list: "".join(f"file '{os.path.abspath(chunk)}'\n" for _, chunk, _ in chunk_cmds)}
+    cmd = f"""
+        {ffmpeg()} -y -hide_banner
+        -f concat -safe 0
+        -i "{concat_list}"
+        -c copy
+        -f mp4
+        "{output}" """
+    return chunk_cmds, " ".join(cmd.split()), output, files
+
+
+def audio_encode_options():
+    return "-c:a aac -ac 2 -b:a 192k"
+
+
+def audio_output(video, dashdir):
+    return os.path.join(dashdir, os.path.splitext(os.path.basename(video))[0] + f"_audio.m4a")
+
+
 def build_audio_encode_command(video, dashdir):
-    output = os.path.join(dashdir, os.path.splitext(os.path.basename(video))[0] + f"_audio.m4a")
+    output = audio_output(video, dashdir)
     cmd = f"""
         {ffmpeg()} -y -hide_banner
         -i {video}
-        -c:a aac
-        -ac 2
-        -b:a 192k
+        {audio_encode_options()}
         -vn
          {output}
         """
@@ -128,27 +509,90 @@ def build_audio_encode_command(video, dashdir):
     return cmd, output
 
 
-def build_manifest_command(video, video_files, audio_files, dashdir, seg_duration=2):
+def codec_adaptation_sets(codecs):
+    """
+    Indices of the video streams per codec, every codec needs its own adaptation set.
+    @param codecs codec of every video stream
+    @return list of stream index lists, None if all streams use the same codec
+    """
+    sets = {}
+    for i, codec in enumerate(codecs):
+        sets.setdefault(codec, []).append(i)
+    return list(sets.values()) if len(sets) > 1 else None
+
+
+def dash_options(seg_duration=2, audio=True, packaging="template", hls_master=None, video_sets=None):
+    """
+    dash muxer options, all video streams and all audio streams form one adaptation set.
+    If there are several video codecs, `video_sets` lists the video stream indices of every adaptation set.
+    @param packaging "template": one file per segment, "single_file": one fragmented mp4 with sidx per
+        representation, segments are byte ranges of it, "cmaf": like template, additionally hls playlists
+        for the same segments are written
+    @param hls_master file name of the hls master playlist for cmaf packaging
+    """
+    adaptation_sets = "id=0,streams=v"
+    if video_sets:
+        adaptation_sets = " ".join(f"id={i},streams={','.join(map(str, x))}" for i, x in enumerate(video_sets))
+    if audio:
+        adaptation_sets += f" id={len(video_sets or [0])},streams=a"
+    segments = "-use_template 1 -use_timeline 0"
+    if packaging == "single_file":
+        segments = "-single_file 1 -global_sidx 1 -use_template 0 -use_timeline 0"
+    if packaging == "cmaf":
+        segments += f" -dash_segment_type mp4 -hls_playlist 1 -hls_master_name {hls_master}"
+    options = f"""
+        -f dash
+        {segments}
+        -seg_duration {seg_duration}
+        -adaptation_sets "{adaptation_sets}"
+        """
+    return " ".join(options.split())
+
+
+def manifest_output(video, dashdir):
+    return os.path.join(dashdir, os.path.splitext(os.path.basename(video))[0] + f"_manifest.mpd")
+
+
+def hls_master_output(video, dashdir):
+    return os.path.join(dashdir, os.path.splitext(os.path.basename(video))[0] + "_master.m3u8")
+
+
+def hls_outputs(video, dashdir, streams):
+    """
+    Hls master playlist and the media playlists of all streams, written for cmaf packaging.
+    """
+    return [hls_master_output(video, dashdir)] + [os.path.join(dashdir, f"media_{i}.m3u8") for i in range(streams)]
+
+
+def packaged_files(manifest, packaging="template"):
+    """
+    Segment files written by the dash muxer for `manifest`.
+    """
+    dashdir = os.path.dirname(manifest)
+    if packaging == "single_file":
+        return glob.glob(os.path.splitext(manifest)[0] + "-stream*.mp4")
+    # cmaf: dash and hls use the same segments
+    return glob.glob(os.path.join(dashdir, "init-stream*.m4s")) + glob.glob(os.path.join(dashdir, "chunk-stream*.m4s"))
+
+
+def build_manifest_command(video, video_files, audio_files, dashdir, seg_duration=2, packaging="template", codecs=None):
     manifest_part = " ".join(
         [f"-i {i}" for i in video_files + audio_files]
     )
 
     map_part = " ".join(
         [f"-map {i}:v" for i in range(len(video_files))] +
-        [f"-map {i}:a" for i in range(len(video_files) + 1, len(video_files + audio_files))]
+        [f"-map {i}:a" for i in range(len(video_files), len(video_files + audio_files))]
     )
 
-    output = os.path.join(dashdir, os.path.splitext(os.path.basename(video))[0] + f"_manifest.mpd")
+    output = manifest_output(video, dashdir)
 
     cmd = f"""
         {ffmpeg()} -y
         {manifest_part}
         -c copy
         {map_part}
-        -f dash
-        -use_template 1 -use_timeline 0
-        -seg_duration {seg_duration}
-        -adaptation_sets "id=0,streams=v id=1,streams=a"
+        {dash_options(seg_duration, audio=len(audio_files) > 0, packaging=packaging, hls_master=os.path.basename(hls_master_output(video, dashdir)), video_sets=codec_adaptation_sets(codecs or []))}
         {output}
         """
     cmd = " ".join(cmd.split())
@@ -156,8 +600,89 @@ def build_manifest_command(video, video_files, audio_files, dashdir, seg_duratio
     return cmd, output
 
 
+def parse_iso_duration(duration):
+    """
+    Seconds of an ISO 8601 duration as used in dash manifests, e.g. PT1H2M3.5S.
+    """
+    match = re.match(r"P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?(?:([\d.]+)S)?", duration)
+    days, hours, minutes, seconds = [float(x) if x else 0 for x in match.groups()]
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+# codec of a representation, based on the prefix of its codecs attribute
+CODEC_TAGS = {"avc1": "h264", "avc3": "h264", "hev1": "hevc", "hvc1": "hevc", "vp09": "vp9", "av01": "av1"}
+
+
+def segment_bitrates(manifest):
+    """
+    Bitrate of every segment of the video representations of a dash manifest, as delivered to the clients,
+    segment sizes are taken from the segment files (template) or the byte ranges (single file).
+    @return dict rendition (e.g. 240p or 240p_av1) -> dict with average and peak bitrate in bit/s, peak/average ratio,
+        the bandwidth stated in the manifest and the bitrates of all segments
+    """
+    ns = {"mpd": "urn:mpeg:dash:schema:mpd:2011"}
+    root = ElementTree.parse(manifest).getroot()
+    dashdir = os.path.dirname(manifest)
+    total_duration = parse_iso_duration(root.get("mediaPresentationDuration"))
+    renditions = {}
+    for adaptation_set in root.iterfind(".//mpd:AdaptationSet", ns):
+        if adaptation_set.get("contentType") != "video":
+            continue
+        for representation in adaptation_set.iterfind("mpd:Representation", ns):
+            segment_list = representation.find("mpd:SegmentList", ns)
+            if segment_list is not None:
+                timing = segment_list
+                sizes = []
+                for segment in segment_list.iterfind("mpd:SegmentURL", ns):
+                    start, end = segment.get("mediaRange").split("-")
+                    sizes.append(int(end) - int(start) + 1)
+            else:
+                timing = representation.find("mpd:SegmentTemplate", ns)
+                pattern = timing.get("media").replace("$RepresentationID$", representation.get("id"))
+                pattern = re.sub(r"\$Number[^$]*\$", "*", pattern)
+                sizes = [os.path.getsize(x) for x in sorted(glob.glob(os.path.join(dashdir, pattern)))]
+            if not sizes:
+                continue
+            seg_duration = int(timing.get("duration")) / int(timing.get("timescale", 1))
+            durations = [seg_duration] * (len(sizes) - 1)
+            durations.append(max(total_duration - sum(durations), 1e-3))
+            bitrates = [8 * size / duration for size, duration in zip(sizes, durations)]
+            average = 8 * sum(sizes) / sum(durations)
+            codecs = representation.get("codecs", adaptation_set.get("codecs", ""))
+            codec = CODEC_TAGS.get(codecs.split(".")[0], "h264")
+            renditions[rendition_name(representation.get("height"), codec)] = {
+                "average": average,
+                "peak": max(bitrates),
+                "peak_ratio": max(bitrates) / average,
+                "bandwidth": int(representation.get("bandwidth", 0)),
+                "segments": bitrates
+            }
+    return renditions
+
+
+def build_compress_command(filenames):
+    """
+    Create precompressed copies of all `filenames` for http delivery,
+    `<filename>.gz` and `<filename>.br` if the brotli tool is available.
+    @return cmd and list of compressed files
+    """
+    files = " ".join(filenames)
+    # -k keeps the uncompressed file, -f overwrites existing variants
+    cmd = f"gzip -9 -k -f {files}"
+    outputs = [x + ".gz" for x in filenames]
+    brotli = shutil.which("brotli")
+    if brotli:
+        cmd += f" && {brotli} -f -k -q 11 {files}"
+        outputs += [x + ".br" for x in filenames]
+    return cmd, outputs
+
+
+def thumbnail_output(video, dashdir):
+    return os.path.join(dashdir, os.path.splitext(os.path.basename(video))[0] + f"_thumb.png")
+
+
 def build_thumbnail(video, dashdir):
-    output = os.path.join(dashdir, os.path.splitext(os.path.basename(video))[0] + f"_thumb.png")
+    output = thumbnail_output(video, dashdir)
     cmd = f"""
         {ffmpeg()} -y -hide_banner
         -i {video}
@@ -170,68 +695,1104 @@ def build_thumbnail(video, dashdir):
     return cmd, output
 
 
-def main(_):
+def split_scale_graph(video, heights, thumbnail=True, copies=1):
+    """
+    filter graph that splits the decoded video into scaled branches `[v<i>]` for all `heights`
+    and (optional) one branch `[thumb]` for the thumbnail.
+    With `copies` > 1 (one per codec) every height is scaled once and split again,
+    copy c of height i is `[v<c * len(heights) + i>]`.
+    """
+    branches = len(heights) + (1 if thumbnail else 0)
+    split_labels = "".join(f"[s{i}]" for i in range(branches))
+    graph = [f"[0:v]split={branches}{split_labels}"]
+    for i, height in enumerate(heights):
+        if copies == 1:
+            graph.append(f"[s{i}]{scale_filter(video, height)}[v{i}]")
+            continue
+        labels = "".join(f"[v{c * len(heights) + i}]" for c in range(copies))
+        graph.append(f"[s{i}]{scale_filter(video, height)},split={copies}{labels}")
+    if thumbnail:
+        graph.append(f"[s{len(heights)}]trim=start=2,setpts=PTS-STARTPTS,scale=-2:540[thumb]")
+    return ";".join(graph)
+
+
+def build_single_decode_command(video, dashdir, heights, seg_duration=2, thumbnail=True, overrides=None, codecs=("h264",)):
+    """
+    Build one ffmpeg call that decodes `video` only once, the decoded frames are split
+    and scaled for all `heights` and `codecs`, audio and (optional) thumbnail are written by the same process.
+    @return cmd, list of video files (all heights of the first codec, then the next codec), audio file (None if the video has no audio)
+    """
+    renditions = [(codec, height) for codec in codecs for height in heights]
+    video_files = []
+    outputs = []
+    for i, (codec, height) in enumerate(renditions):
+        video_files.append(video_output(video, dashdir, height, codec))
+        outputs.append(f"""-map "[v{i}]" {video_encode_options(video, height, seg_duration, overrides=overrides, codec=codec)} -f mp4 "{video_files[-1]}" """)
+
+    audio_file = None
+    if probe(video)["audio"] is not None:
+        audio_file = audio_output(video, dashdir)
+        outputs.append(f"""-map 0:a:0 -vn {audio_encode_options()} "{audio_file}" """)
+    if thumbnail:
+        outputs.append(f"""-map "[thumb]" -vframes 1 "{thumbnail_output(video, dashdir)}" """)
+
+    cmd = f"""
+        {ffmpeg()} -y -hide_banner
+        -i "{video}"
+        -filter_complex "{split_scale_graph(video, heights, thumbnail, copies=len(codecs))}"
+        {" ".join(outputs)}
+        """
+    cmd = " ".join(cmd.split())
+    return cmd, video_files, audio_file
+
+
+def build_direct_dash_command(video, dashdir, heights, seg_duration=2, thumbnail=True, packaging="template", overrides=None, codecs=("h264",)):
+    """
+    Build one ffmpeg call that decodes `video` once and encodes all renditions (all `heights` for all `codecs`)
+    directly into the dash muxer, no intermediate mp4 files are written.
+    @return cmd, manifest file
+    """
+    renditions = [(codec, height) for codec in codecs for height in heights]
+    audio = probe(video)["audio"] is not None
+    maps = [f"""-map "[v{i}]" """ for i in range(len(renditions))]
+    options = [
+        video_encode_options(video, height, seg_duration, stream=i, overrides=overrides, codec=codec)
+        for i, (codec, height) in enumerate(renditions)
+    ]
+    if audio:
+        maps.append("-map 0:a:0")
+        options.append(audio_encode_options())
+
+    output = manifest_output(video, dashdir)
+    thumbnail_part = ""
+    if thumbnail:
+        thumbnail_part = f"""-map "[thumb]" -vframes 1 "{thumbnail_output(video, dashdir)}" """
+
+    cmd = f"""
+        {ffmpeg()} -y -hide_banner
+        -i "{video}"
+        -filter_complex "{split_scale_graph(video, heights, thumbnail, copies=len(codecs))}"
+        {" ".join(maps)}
+        {" ".join(options)}
+        {dash_options(seg_duration, audio=audio, packaging=packaging, hls_master=os.path.basename(hls_master_output(video, dashdir)), video_sets=codec_adaptation_sets([codec for codec, _ in renditions]))}
+        "{output}"
+        {thumbnail_part}
+        """
+    cmd = " ".join(cmd.split())
+    return cmd, output
+
+
+@functools.lru_cache()
+def encoder_version():
+    return shell_call(f"{ffmpeg()} -version").split("\n")[0]
+
+
+def load_build_cache(cache_file):
+    """
+    Load the build cache, a mapping of output file -> key of the job that created it.
+    """
+    if not os.path.isfile(cache_file):
+        return {}
+    with open(cache_file) as cfp:
+        return json.load(cfp)
+
+
+def save_build_cache(cache_file, cache):
+    with open(cache_file, "w") as cfp:
+        json.dump(cache, cfp, indent=4, sort_keys=True)
+
+
+def plan_build(jobs, cache, source_hash, force=False):
+    """
+    Decide which jobs need to run, jobs that can be skipped are marked with `cached`.
+    Each job gets a key based on the content hash of the source video, the exact command,
+    the encoder version and the keys of the jobs it depends on.
+    A job is up to date if all its `outputs` exist and were created with the same key.
+    Jobs marked as `intermediate` (e.g. chunks, that are removed after use) only
+    run if a job that depends on them runs.
+    @param jobs list of job dicts in execution order, see `run_jobs`
+    @param cache build cache, see `load_build_cache`
+    @param source_hash content hash of the input video
+    @param force run all jobs
+    """
+    keys = {}
+    for job in jobs:
+        h = hashlib.sha256()
+        h.update(source_hash.encode())
+        h.update(encoder_version().encode())
+        h.update(job["cmd"].encode())
+        for dep in job.get("after", []):
+            h.update(keys[dep].encode())
+        job["key"] = keys[job["name"]] = h.hexdigest()
+
+    run = {}
+    for job in reversed(jobs):
+        if job.get("intermediate"):
+            run[job["name"]] = any(run[x["name"]] for x in jobs if job["name"] in x.get("after", []))
+        else:
+            run[job["name"]] = force or not all(
+                os.path.exists(x) and cache.get(x) == job["key"] for x in job.get("outputs", [])
+            ) or len(job.get("outputs", [])) == 0
+    for job in jobs:
+        job["cached"] = not run[job["name"]]
+
+
+def update_build_cache(cache, jobs, results):
+    """
+    Store the keys of all outputs of successfully finished jobs in the build cache.
+    """
+    for job in jobs:
+        if results[job["name"]]["returncode"] == 0 and "key" in job:
+            for output in job.get("outputs", []):
+                cache[output] = job["key"]
+
+
+def parse_progress_time(values):
+    """
+    encoded duration in seconds of an ffmpeg `-progress` block
+    """
+    for key in ["out_time_us", "out_time_ms"]:  # out_time_ms is also in microseconds
+        if values.get(key, "N/A").lstrip("-").isdigit():
+            return max(0, int(values[key])) / 1000000
+    return 0
+
+
+class ProgressMonitor:
+    """
+    Collects the `-progress` output of all running ffmpeg jobs,
+    shows an aggregated status line and (optional) writes all updates as json lines.
+    """
+    def __init__(self, json_file=None, interval=1):
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._json_fp = open(json_file, "a") if json_file else None
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def update(self, job, values):
+        """
+        Store one progress block of `job`, `values` are the parsed key=value lines.
+        """
+        out_time = parse_progress_time(values)
+        speed = values.get("speed", "N/A").strip().rstrip("x")
+        speed = float(speed) if speed.replace(".", "", 1).isdigit() else 0
+        duration = job.get("duration", 0)
+        eta = (duration - out_time) / speed if speed > 0 and duration > 0 else None
+        state = {
+            "job": job["name"],
+            "time": time.time(),
+            "frame": int(values.get("frame", 0)) if values.get("frame", "").isdigit() else 0,
+            "fps": float(values.get("fps", 0)) if values.get("fps", "").replace(".", "", 1).isdigit() else 0,
+            "speed": speed,
+            "bitrate": values.get("bitrate", "N/A").strip(),
+            "out_time": out_time,
+            "duration": duration,
+            "progress": min(1, out_time / duration) if duration > 0 else None,
+            "eta": max(0, eta) if eta is not None else None,
+            "state": "end" if values.get("progress") == "end" else "running"
+        }
+        with self._lock:
+            self._jobs[job["name"]] = state
+            if self._json_fp:
+                self._json_fp.write(json.dumps(state) + "\n")
+                self._json_fp.flush()
+
+    def finish(self, job, returncode):
+        with self._lock:
+            state = self._jobs.pop(job["name"], {"job": job["name"]})
+            if self._json_fp:
+                state.update({"time": time.time(), "state": "finished", "returncode": returncode})
+                self._json_fp.write(json.dumps(state) + "\n")
+                self._json_fp.flush()
+
+    def status_line(self):
+        with self._lock:
+            states = sorted(self._jobs.values(), key=lambda x: x["job"])
+        parts = []
+        for state in states:
+            part = f"{state['job']} {state['fps']:.0f}fps {state['speed']:.2f}x"
+            if state["progress"] is not None:
+                part += f" {100 * state['progress']:.0f}%"
+            if state["eta"] is not None:
+                part += f" eta {int(state['eta'])}s"
+            parts.append(part)
+        return f"[{len(states)} running] " + " | ".join(parts)
+
+    def _show(self):
+        while not self._stopped.wait(self._interval):
+            line = self.status_line()
+            sys.stderr.write("\r" + line[:shutil.get_terminal_size().columns - 1].ljust(shutil.get_terminal_size().columns - 1))
+            sys.stderr.flush()
+
+    def start(self):
+        # the live status line is only useful for interactive terminals
+        if sys.stderr.isatty():
+            self._thread = threading.Thread(target=self._show, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            sys.stderr.write("\n")
+        if self._json_fp:
+            self._json_fp.close()
+
+
+def run_job(job, monitor=None):
+    """
+    Run one job and measure its wall time.
+    @param job dict with at least `name` and `cmd`, `cleanup` lists folders that are deleted after success,
+        `files` maps files that are written before the command starts to their content,
+        `duration` is the expected duration of the encoded video, used for progress estimation
+    @param monitor optional ProgressMonitor, then ffmpeg reports its progress via `-progress`,
+        jobs with `progress` set to False are no ffmpeg commands and are not monitored
+    @return dict with name, returncode, wall_time and resource usage of the job
+    """
+    print(f"run {job['cmd']}")
+    start = time.time()
+    # folders and input files are only created for jobs that really run
+    for output in job.get("outputs", []) + list(job.get("files", {})):
+        if os.path.dirname(output):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+    for filename, content in job.get("files", {}).items():
+        with open(filename, "w") as ffp:
+            ffp.write(content)
+    if monitor is None or not job.get("progress", True):
+        process = subprocess.Popen(job["cmd"], shell=True)
+    else:
+        # all commands start with the ffmpeg executable
+        executable, parameters = job["cmd"].split(" ", 1)
+        cmd = f"{executable} -progress pipe:1 -nostats {parameters}"
+        process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, universal_newlines=True)
+        values = {}
+        for line in process.stdout:
+            key, _, value = line.strip().partition("=")
+            values[key] = value
+            if key == "progress":
+                monitor.update(job, values)
+                values = {}
+    # wait4 provides the resource usage of the finished child process
+    _, status, rusage = os.wait4(process.pid, 0)
+    # same convention as Popen.returncode, os.waitstatus_to_exitcode needs python 3.9
+    returncode = process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    if monitor is not None:
+        monitor.finish(job, returncode)
+    if returncode == 0:
+        # remove temporary files that are not needed anymore
+        for path in job.get("cleanup", []):
+            shutil.rmtree(path, ignore_errors=True)
+    end = time.time()
+    return {
+        "name": job["name"],
+        "returncode": returncode,
+        "wall_time": end - start,
+        "start": start,
+        "end": end,
+        "user_time": rusage.ru_utime,
+        "system_time": rusage.ru_stime,
+        "peak_rss_kb": rusage.ru_maxrss
+    }
+
+
+def run_jobs(jobs, max_workers=1, monitor=None, incoming=None):
+    """
+    Run jobs with at most `max_workers` processes in parallel.
+    Ready jobs with the highest `cost` are started first.
+    A job may list names of other jobs in `after`, then it is only started when all of them
+    finished successfully, otherwise it is skipped (returncode None).
+    Jobs marked as `cached` are not run, see `plan_build`.
+    @param jobs list of job dicts, see `run_job`
+    @param max_workers maximum number of concurrently running jobs
+    @param monitor optional ProgressMonitor for all jobs
+    @param incoming optional queue.Queue for lists of further jobs that are added while jobs are running,
+        e.g. of titles that are planned in parallel, None in the queue marks the end
+    @return dict job name -> result of `run_job`
+    """
+    results = {}
+    names = set()
+    ready = []  # heap of (-cost, order, job), longest jobs first, equal costs in the given order
+    order = itertools.count()
+    blocked = {}  # job name -> number of jobs it still waits for
+    dependents = {}  # job name -> jobs that wait for it
+
+    def add(new_jobs):
+        names.update(job["name"] for job in new_jobs)
+        for job in new_jobs:
+            unknown = set(job.get("after", [])) - names
+            assert len(unknown) == 0, f"job {job['name']} depends on unknown jobs {unknown}"
+            missing = [x for x in job.get("after", []) if x not in results]
+            for x in missing:
+                dependents.setdefault(x, []).append(job)
+            if missing:
+                blocked[job["name"]] = len(missing)
+            else:
+                heapq.heappush(ready, (-job.get("cost", 0), next(order), job))
+
+    def finish(job, result):
+        results[job["name"]] = result
+        for dependent in dependents.pop(job["name"], []):
+            blocked[dependent["name"]] -= 1
+            if blocked[dependent["name"]] == 0:
+                del blocked[dependent["name"]]
+                heapq.heappush(ready, (-dependent.get("cost", 0), next(order), dependent))
+
+    add(jobs)
+    more = incoming is not None
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while ready or running or more:
+            while more:
+                # only block if there is nothing else to do
+                try:
+                    new_jobs = incoming.get(block=not (ready or running))
+                except queue.Empty:
+                    break
+                if new_jobs is None:
+                    more = False
+                else:
+                    add(new_jobs)
+            while ready and len(running) < max_workers:
+                _, _, job = heapq.heappop(ready)
+                if job.get("cached"):
+                    finish(job, {"name": job["name"], "returncode": 0, "wall_time": 0, "cached": True})
+                    continue
+                if any(results[x]["returncode"] != 0 for x in job.get("after", [])):
+                    print(f"skip {job['name']}, a required job failed")
+                    finish(job, {"name": job["name"], "returncode": None, "wall_time": 0})
+                    continue
+                running[pool.submit(run_job, job, monitor)] = job
+            if not running:
+                continue
+            # with free workers new jobs from `incoming` are checked regularly
+            timeout = 0.1 if more and len(running) < max_workers else None
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                finish(job, future.result())
+    return results
+
+
+def title_folder(video, a):
+    """
+    Create and return the folder for all outputs of `video`.
+    """
+    dash_folder = a["dash_folder"]
+    if a["auto_subfolders"]:
+        dash_folder = os.path.join(dash_folder, os.path.splitext(os.path.basename(video))[0])
+    os.makedirs(dash_folder, exist_ok=True)
+    return dash_folder
+
+
+def build_sample_command(video, output, samples=3, sample_duration=4):
+    """
+    Cut `samples` excerpts evenly distributed over `video` and store them losslessly in one file,
+    the whole video is used if it is too short.
+    @return cmd, sample file, duration of the sample in seconds
+    """
+    duration = probe(video)["duration"]
+    if duration <= samples * sample_duration:
+        starts, sample_duration = [0], duration
+    else:
+        starts = [(duration - sample_duration) * (i + 0.5) / samples for i in range(samples)]
+    inputs = " ".join(f"""-ss {start:.3f} -t {sample_duration} -i "{video}" """ for start in starts)
+    concat = "".join(f"[{i}:v]" for i in range(len(starts))) + f"concat=n={len(starts)}:v=1:a=0[v]"
+    cmd = f"""
+        {ffmpeg()} -y -hide_banner
+        {inputs}
+        -filter_complex "{concat}"
+        -map "[v]"
+        -c:v libx264 -preset ultrafast -qp 0 -pix_fmt yuv420p
+        "{output}" """
+    return " ".join(cmd.split()), output, len(starts) * sample_duration
+
+
+def build_trial_command(video, sample, trialdir, height, crf, seg_duration=2, metric="ssim"):
+    """
+    Encode `sample` with one height and crf, upscale it again to the source resolution
+    and compare it with `sample`, per frame quality values are stored in a stats file.
+    @return cmd, encoded trial file, stats file
+    """
+    meta = probe(video)
+    output = os.path.join(trialdir, f"{height}p_crf{crf}.mp4")
+    stats = os.path.join(trialdir, f"{height}p_crf{crf}_{metric}.log")
+    cmd = f"""
+        {ffmpeg()} -y -hide_banner
+        -i "{sample}"
+        {video_encode_options(video, height, seg_duration, overrides={height: {"crf": crf}})}
+        -vf "{scale_filter(video, height)}"
+        -f mp4
+        "{output}"
+        &&
+        {ffmpeg()} -y -hide_banner
+        -i "{output}" -i "{sample}"
+        -lavfi "[0:v]scale={meta['width']}:{meta['height']}:flags=bicubic[d];[d][1:v]{metric}=stats_file={stats}"
+        -f null - """
+    return " ".join(cmd.split()), output, stats
+
+
+def read_quality(stats_file, metric="ssim"):
+    """
+    Average quality in dB of a ssim or psnr stats file, ssim is converted to dB.
+    """
+    key = "All:" if metric == "ssim" else "psnr_avg:"
+    values = []
+    with open(stats_file) as sfp:
+        for line in sfp:
+            value = line.split(key)[1].split()[0]
+            values.append(float(value) if value != "inf" else (1 if metric == "ssim" else 100))
+    quality = sum(values) / len(values)
+    if metric == "ssim":
+        return min(100, -10 * math.log10(max(1 - quality, 1e-10)))
+    return quality
+
+
+def convex_hull(points):
+    """
+    Upper convex hull of rate-quality points, with the logarithm of the bitrate as x axis.
+    @param points list of dicts with at least bitrate and quality
+    @return points on the hull, sorted by bitrate
+    """
+    def below(a, b, c):
+        # True if b is below or on the line from a to c
+        ax, bx, cx = math.log(a["bitrate"]), math.log(b["bitrate"]), math.log(c["bitrate"])
+        return (bx - ax) * (c["quality"] - a["quality"]) - (b["quality"] - a["quality"]) * (cx - ax) >= 0
+
+    hull = []
+    for point in sorted(points, key=lambda x: (x["bitrate"], -x["quality"])):
+        # points that are not better than a cheaper point are never efficient
+        if hull and point["quality"] <= hull[-1]["quality"]:
+            continue
+        while len(hull) >= 2 and below(hull[-2], hull[-1], point):
+            hull.pop()
+        hull.append(point)
+    return hull
+
+
+def select_rungs(hull, rungs):
+    """
+    Select up to `rungs` hull points with evenly spaced (logarithmic) bitrates, one per height.
+    @return dict height -> {"crf": crf}
+    """
+    selected = hull
+    if len(hull) > rungs > 1:
+        low, high = math.log(hull[0]["bitrate"]), math.log(hull[-1]["bitrate"])
+        targets = [low + (high - low) * i / (rungs - 1) for i in range(rungs)]
+        selected = [min(hull, key=lambda x: abs(math.log(x["bitrate"]) - target)) for target in targets]
+    elif rungs == 1:
+        selected = hull[-1:]
+    ladder = {}
+    for point in selected:
+        ladder.setdefault(point["height"], {"crf": point["crf"]})
+    return dict(sorted(ladder.items()))
+
+
+def per_title_ladders(videos, a):
+    """
+    Per-title analysis, trial encodes of sampled excerpts of every video are run with all
+    combinations of ladder heights and crf values (all videos in parallel), the convex hull of
+    bitrate and quality is used to select the heights and crfs of the final ladder.
+    Results are stored in `<video>_per_title.json` and reused, as long as video and settings are unchanged.
+    @return dict video -> ladder (height -> {"crf": crf}), list of videos where trial encodes failed
+    """
+    ladders = {}
+    failed_videos = []
+    analyses = []
+    jobs = []
+    seg_duration = 2
+    for video in videos:
+        name = os.path.splitext(os.path.basename(video))[0]
+        dash_folder = title_folder(video, a)
+        try:
+            meta = probe(video, sidecar=os.path.join(dash_folder, name + "_probe.json"))
+        except Exception as e:
+            # the title is reported as failed when it is planned
+            print(f"skip per-title analysis of {video}: {e}")
+            continue
+        heights = build_ladder(video, RESOLUTIONS, policy=a["ladder_policy"], native_top=a["native_top"])
+        trialdir = os.path.join(dash_folder, name + "_per_title")
+        os.makedirs(trialdir, exist_ok=True)
+
+        sample_cmd, sample, sample_duration = build_sample_command(
+            video, os.path.join(trialdir, "sample.mp4"), a["per_title_samples"], a["per_title_sample_duration"]
+        )
+        trials = []
+        for height in heights:
+            for crf in a["per_title_crfs"]:
+                cmd, output, stats = build_trial_command(video, sample, trialdir, height, crf, seg_duration, a["per_title_metric"])
+                trials.append({
+                    "name": f"{name}/per_title/{height}p_crf{crf}",
+                    "cmd": cmd,
+                    "height": height,
+                    "crf": crf,
+                    "output": output,
+                    "stats": stats
+                })
+        rungs = a["per_title_rungs"] or len(heights)
+        key = hashlib.sha256(json.dumps(
+            [meta["hash"], encoder_version(), sample_cmd, [x["cmd"] for x in trials], rungs]
+        ).encode()).hexdigest()
+        result_file = os.path.join(dash_folder, name + "_per_title.json")
+        if os.path.isfile(result_file) and not a["force"]:
+            with open(result_file) as rfp:
+                result = json.load(rfp)
+            # without encoding the ladder of the existing encodes is needed
+            if result["key"] == key or a["no_encoding"]:
+                print(f"reuse per-title analysis of {result_file}")
+                ladders[video] = {int(height): values for height, values in result["ladder"].items()}
+                shutil.rmtree(trialdir)
+                continue
+        if a["no_encoding"]:
+            shutil.rmtree(trialdir)
+            continue
+
+        sample_job = f"{name}/per_title/sample"
+        jobs.append({"name": sample_job, "cmd": sample_cmd, "cost": meta["duration"], "progress": False})
+        for trial in trials:
+            jobs.append({
+                "name": trial["name"],
+                "cmd": trial["cmd"],
+                "after": [sample_job],
+                "cost": sample_duration * (trial["height"] * trial["height"] * 16 / 9 + 100000),
+                # encoding and quality measurement are two ffmpeg calls
+                "progress": False
+            })
+        analyses.append((video, trialdir, trials, sample_duration, rungs, key, result_file))
+
+    results = run_jobs(jobs, max_workers=a["jobs"])
+
+    for video, trialdir, trials, sample_duration, rungs, key, result_file in analyses:
+        failed = [x["name"] for x in trials if results[x["name"]]["returncode"] != 0]
+        if failed:
+            # the trial folder is kept for debugging
+            print(f"per-title analysis of {video} failed, trials {failed} did not finish, see {trialdir}")
+            failed_videos.append(video)
+            continue
+        points = []
+        for trial in trials:
+            points.append({
+                "height": trial["height"],
+                "crf": trial["crf"],
+                "bitrate": 8 * os.path.getsize(trial["output"]) / sample_duration,
+                "quality": read_quality(trial["stats"], a["per_title_metric"])
+            })
+        hull = convex_hull(points)
+        ladders[video] = select_rungs(hull, rungs)
+        with open(result_file, "w") as rfp:
+            json.dump({
+                "key": key,
+                "metric": a["per_title_metric"],
+                "points": points,
+                "hull": hull,
+                "ladder": ladders[video]
+            }, rfp, indent=4)
+        shutil.rmtree(trialdir)
+        print(f"per-title ladder of {video}: {ladders[video]}, details in {result_file}")
+    return ladders, failed_videos
+
+
+def plan_title(video, a, ladder=None):
+    """
+    Plan all jobs to create the dash version of one video.
+    @param video input video
+    @param a parsed command line arguments
+    @param ladder optional per-title ladder, height -> {"crf": crf}, see `per_title_ladders`
+    @return dict with name, dash folder, manifest, jobs and build cache of the title
+    """
+    name = os.path.splitext(os.path.basename(video))[0]
+    dash_folder = title_folder(video, a)
+
+    print(f"store dashed video in {dash_folder}")
+
+    # probe the input only once, all command builders use the cached result
+    meta = probe(video, sidecar=os.path.join(dash_folder, name + "_probe.json"))
+
+    resolutions = build_ladder(video, RESOLUTIONS, policy=a["ladder_policy"], native_top=a["native_top"])
+    codecs = a["codecs"]
+    if ladder:
+        resolutions = sorted(ladder)
+    # encoding settings that replace the defaults of video_encode_options
+    overrides = {height: dict(ladder.get(height, {})) if ladder else {} for height in resolutions}
+    if a["rate_control"] == "capped_crf":
+        for height in resolutions:
+            maxrate = target_bitrate(height, a["target_bitrates"])
+            overrides[height].update({"maxrate": maxrate, "bufsize": int(maxrate * a["vbv_buffer"])})
+
+    seg_duration = 2
+
+    def cost(height, codec="h264"):
+        # rough estimation of the encoding time, used for scheduling the longest jobs first
+        return meta["duration"] * (height * height * 16 / 9 + 100000) * CODEC_COST[codec]
+
+    renditions = [(codec, height) for codec in codecs for height in resolutions]
+    total_cost = sum(cost(height, codec) for codec, height in renditions)
+
+    # collect all jobs and output files
+    jobs = []
+    thumbnail = thumbnail_output(video, dash_folder)
+    create_thumbnail = True
+    playlists = []
+    if a["encoding_mode"] == "direct":
+        # encode directly into the dash muxer, there are no intermediate files for a separate manifest step
+        cmd, manifest = build_direct_dash_command(
+            video, dash_folder, resolutions, seg_duration=seg_duration, packaging=a["packaging"], overrides=overrides,
+            codecs=codecs
+        )
+        if a["packaging"] == "cmaf":
+            playlists = hls_outputs(video, dash_folder, len(renditions) + (meta["audio"] is not None))
+        jobs.append({
+            "name": "direct",
+            "cmd": cmd,
+            "outputs": [manifest, thumbnail] + playlists,
+            "cost": total_cost,
+            "stage": "encode"
+        })
+        video_files = []
+        audio_file = None
+        create_thumbnail = a["no_encoding"]
+    elif a["encoding_mode"] == "single_decode":
+        # one process for everything, video is decoded once
+        cmd, video_files, audio_file = build_single_decode_command(
+            video, dash_folder, resolutions, seg_duration=seg_duration, overrides=overrides, codecs=codecs
+        )
+        jobs.append({
+            "name": "single_decode",
+            "cmd": cmd,
+            "outputs": video_files + [x for x in [audio_file, thumbnail] if x],
+            "cost": total_cost,
+            "stage": "encode"
+        })
+        create_thumbnail = a["no_encoding"]
+    else:
+        video_files = []
+        for codec, resolution in renditions:
+            rendition = rendition_name(resolution, codec)
+            job_name = f"video_{rendition}"
+            if a["encoding_mode"] == "chunked":
+                chunk_cmds, cmd, outfile, files = build_chunked_video_encode_commands(
+                    video, dash_folder, resolution, seg_duration=seg_duration, chunk_duration=a["chunk_duration"],
+                    overrides=overrides, codec=codec
+                )
+                chunk_jobs = [
+                    {
+                        "name": f"{job_name}_chunk{i}",
+                        "cmd": x,
+                        "outputs": [chunk],
+                        "intermediate": True,
+                        "cost": cost(resolution, codec) / len(chunk_cmds),
+                        "duration": duration,
+                        "stage": "encode",
+                        "rendition": rendition
+                    }
+                    for i, (x, chunk, duration) in enumerate(chunk_cmds)
+                ]
+                jobs.extend(chunk_jobs)
+                jobs.append({
+                    "name": job_name,
+                    "cmd": cmd,
+                    "outputs": [outfile],
+                    "after": [job["name"] for job in chunk_jobs],
+                    "files": files,
+                    "cleanup": [os.path.dirname(chunk_cmds[0][1])],
+                    "stage": "encode",
+                    "rendition": rendition
+                })
+            else:
+                cmd, outfile = build_video_encode_command(
+                    video, dash_folder, resolution, seg_duration=seg_duration, overrides=overrides, codec=codec
+                )
+                jobs.append({
+                    "name": job_name,
+                    "cmd": cmd,
+                    "outputs": [outfile],
+                    "cost": cost(resolution, codec),
+                    "stage": "encode",
+                    "rendition": rendition
+                })
+            video_files.append(outfile)
+
+        # for audio only one quality is considered
+        # TODO: maybe use more?
+        audio_file = None
+        if meta["audio"] is not None:
+            cmd, audio_file = build_audio_encode_command(video, dash_folder)
+            jobs.append({
+                "name": "audio",
+                "cmd": cmd,
+                "outputs": [audio_file],
+                "cost": cost(0),
+                "stage": "encode",
+                "rendition": "audio"
+            })
+    audio_files = [audio_file] if audio_file else []
+    # rendition name and codec of every video file
+    video_renditions = {
+        video_output(video, dash_folder, height, codec): (rendition_name(height, codec), codec) for codec, height in renditions
+    }
+
+    if a["no_encoding"]:
+        # only use renditions that are already available
+        video_files = [x for x in video_files if os.path.isfile(x)]
+        audio_files = [x for x in audio_files if os.path.isfile(x)]
+        jobs = []
+    # the manifest is only created after all encodings are finished
+    encode_jobs = [job["name"] for job in jobs]
+
+    if create_thumbnail:
+        cmd, _ = build_thumbnail(video, dash_folder)
+        jobs.append({"name": "thumbnail", "cmd": cmd, "outputs": [thumbnail], "duration": 0, "stage": "thumbnail"})
+
+    if a["encoding_mode"] != "direct":
+        cmd, manifest = build_manifest_command(
+            video, video_files, audio_files, dash_folder, seg_duration=seg_duration, packaging=a["packaging"],
+            codecs=[video_renditions[x][1] for x in video_files]
+        )
+        if a["packaging"] == "cmaf":
+            playlists = hls_outputs(video, dash_folder, len(video_files) + len(audio_files))
+        jobs.append({"name": "manifest", "cmd": cmd, "outputs": [manifest] + playlists, "after": encode_jobs, "stage": "manifest"})
+
+    manifest_jobs = [job["name"] for job in jobs if manifest in job["outputs"]]
+    if manifest_jobs or os.path.isfile(manifest):
+        cmd, outputs = build_compress_command([manifest] + playlists)
+        jobs.append({
+            "name": "compress_manifest",
+            "cmd": cmd,
+            "outputs": outputs,
+            "after": manifest_jobs,
+            "duration": 0,
+            "stage": "manifest",
+            "progress": False
+        })
+
+    for job in jobs:
+        job.setdefault("duration", meta["duration"])
+
+    # only run jobs where the command, the input video or the encoder changed
+    build_cache_file = os.path.join(dash_folder, name + "_build_cache.json")
+    build_cache = load_build_cache(build_cache_file)
+    plan_build(jobs, build_cache, meta["hash"], force=a["force"])
+
+    # job names must be unique for all titles
+    for job in jobs:
+        job["name"] = f"{name}/{job['name']}"
+        job["after"] = [f"{name}/{x}" for x in job.get("after", [])]
+    return {
+        "name": name,
+        "video": video,
+        "dash_folder": dash_folder,
+        "manifest": manifest,
+        "duration": meta["duration"],
+        "encoding_mode": a["encoding_mode"],
+        "packaging": a["packaging"],
+        "video_files": video_files,
+        "video_renditions": video_renditions,
+        "audio_files": audio_files,
+        "jobs": jobs,
+        "build_cache_file": build_cache_file,
+        "build_cache": build_cache
+    }
+
+
+
+def usage_summary(results):
+    """
+    Aggregate wall time, cpu time and peak memory of executed jobs.
+    """
+    executed = [x for x in results if "start" in x]
+    if len(executed) == 0:
+        return {"jobs": 0, "wall_time": 0, "cpu_time": 0, "peak_rss_kb": 0}
+    return {
+        "jobs": len(executed),
+        "wall_time": max(x["end"] for x in executed) - min(x["start"] for x in executed),
+        "cpu_time": sum(x["user_time"] + x["system_time"] for x in executed),
+        "peak_rss_kb": max(x["peak_rss_kb"] for x in executed)
+    }
+
+
+def write_report(title, results):
+    """
+    Write a json report with timings and resource usage per stage and per rendition,
+    output sizes, bitrates and realtime factor for one encoded title.
+    @return report file
+    """
+    title_results = [results[job["name"]] for job in title["jobs"]]
+    duration = title["duration"]
+    report = {
+        "video": title["video"],
+        "duration": duration,
+        "encoding_mode": title["encoding_mode"],
+        "total": usage_summary(title_results),
+        "stages": {},
+        "renditions": {},
+        "jobs": title_results
+    }
+    for stage in sorted({job["stage"] for job in title["jobs"]}):
+        report["stages"][stage] = usage_summary([results[job["name"]] for job in title["jobs"] if job["stage"] == stage])
+    for rendition in sorted({job["rendition"] for job in title["jobs"] if "rendition" in job}):
+        report["renditions"][rendition] = usage_summary(
+            [results[job["name"]] for job in title["jobs"] if job.get("rendition") == rendition]
+        )
+
+    for media_file in title["video_files"] + title["audio_files"]:
+        rendition = "audio" if media_file in title["audio_files"] else title["video_renditions"][media_file][0]
+        if os.path.isfile(media_file):
+            size = os.path.getsize(media_file)
+            report["renditions"].setdefault(rendition, {}).update({
+                "size": size,
+                "bitrate": 8 * size / duration if duration > 0 else 0
+            })
+    # outputs of the jobs that were run, segments are written by the job that writes the manifest
+    written = {x for job in title["jobs"] if "start" in results[job["name"]] for x in job.get("outputs", [])}
+    if title["manifest"] in written:
+        written.update(packaged_files(title["manifest"], title["packaging"]))
+    report["bytes_written"] = sum(os.path.getsize(x) for x in written if os.path.isfile(x))
+    if os.path.isfile(title["manifest"]):
+        report["segment_bitrates"] = segment_bitrates(title["manifest"])
+    # in direct mode packaging is part of the encoding and can not be measured separately
+    manifest_result = results.get(f"{title['name']}/manifest", {})
+    segment_files = packaged_files(title["manifest"], title["packaging"])
+    report["packaging"] = {
+        "mode": title["packaging"],
+        "files": len(segment_files),
+        "size": sum(os.path.getsize(x) for x in segment_files),
+        "wall_time": manifest_result.get("wall_time")
+    }
+    wall_time = report["total"]["wall_time"]
+    report["realtime_factor"] = duration / wall_time if wall_time > 0 else None
+    for values in report["renditions"].values():
+        if values.get("wall_time"):
+            values["realtime_factor"] = duration / values["wall_time"]
+
+    report_file = os.path.join(title["dash_folder"], title["name"] + "_report.json")
+    with open(report_file, "w") as rfp:
+        json.dump(report, rfp, indent=4)
+    return report_file
+
+
+def summarize_reports(folder):
+    """
+    Aggregate all encoding reports stored in `folder` (and its subfolders).
+    """
+    reports = []
+    for report_file in sorted(glob.glob(os.path.join(folder, "**", "*_report.json"), recursive=True)):
+        with open(report_file) as rfp:
+            reports.append(json.load(rfp))
+    summary = {
+        "videos": len(reports),
+        "duration": sum(x["duration"] for x in reports),
+        "wall_time": sum(x["total"]["wall_time"] for x in reports),
+        "cpu_time": sum(x["total"]["cpu_time"] for x in reports),
+        "peak_rss_kb": max([x["total"]["peak_rss_kb"] for x in reports], default=0),
+        "bytes_written": sum(x["bytes_written"] for x in reports),
+        "stages": {},
+        "renditions": {},
+        "packaging": {}
+    }
+    for report in reports:
+        if "packaging" not in report:
+            continue
+        packaging = report["packaging"]
+        agg = summary["packaging"].setdefault(packaging["mode"], {"videos": 0, "files": 0, "size": 0, "wall_time": 0})
+        agg["videos"] += 1
+        agg["files"] += packaging["files"]
+        agg["size"] += packaging["size"]
+        agg["wall_time"] += packaging["wall_time"] or 0
+    summary["realtime_factor"] = summary["duration"] / summary["wall_time"] if summary["wall_time"] > 0 else None
+    for key in ["stages", "renditions"]:
+        for report in reports:
+            for name, values in report[key].items():
+                agg = summary[key].setdefault(name, {"videos": 0, "wall_time": 0, "cpu_time": 0, "peak_rss_kb": 0})
+                agg["videos"] += 1
+                agg["wall_time"] += values.get("wall_time", 0)
+                agg["cpu_time"] += values.get("cpu_time", 0)
+                agg["peak_rss_kb"] = max(agg["peak_rss_kb"], values.get("peak_rss_kb", 0))
+                if "size" in values:
+                    agg["size"] = agg.get("size", 0) + values["size"]
+    return summary
+
+
+VIDEO_EXTENSIONS = {".mp4", ".mkv", ".mov", ".avi", ".webm", ".mxf", ".ts", ".y4m", ".m4v", ".mpg", ".mpeg"}
+
+
+def collect_videos(inputs):
+    """
+    Expand the input arguments to a list of video files,
+    an input can be a video, a folder with videos, a glob pattern or a text file listing one video per line.
+    """
+    videos = []
+    for x in inputs:
+        if os.path.isdir(x):
+            videos.extend(sorted(
+                os.path.join(x, f) for f in os.listdir(x)
+                if os.path.splitext(f)[1].lower() in VIDEO_EXTENSIONS
+            ))
+        elif os.path.isfile(x) and os.path.splitext(x)[1].lower() in {".txt", ".list"}:
+            with open(x) as lfp:
+                videos.extend(collect_videos([l.strip() for l in lfp if l.strip() and not l.startswith("#")]))
+        elif os.path.isfile(x):
+            videos.append(x)
+        else:
+            matches = sorted(glob.glob(x))
+            if len(matches) == 0:
+                print(f"{x} does not exist, skip it")
+            videos.extend(collect_videos(matches))
+    return videos
+
+
+def main(args):
     # argument parsing
     parser = argparse.ArgumentParser(description='create dash representations',
                                      epilog="stg7 2019",
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument("video", type=str, help="video to convert to a dash version")
+    parser.add_argument("video", type=str, nargs="*", help="video to convert to a dash version, can also be a folder, a glob pattern or a text file with one video per line")
     parser.add_argument("--dash_folder", type=str, default="dash", help="folder for storing the dash video")
     parser.add_argument("--auto_subfolders", "-as", action="store_true", help="create subfolder based on videoname")
     parser.add_argument("--no_encoding", "-ne", action="store_true", help="don't encode the videos again")
+    parser.add_argument("--force", "-f", action="store_true", help="run all jobs, even if their outputs are up to date")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="number of encoding jobs running in parallel")
+    parser.add_argument("--encoding_mode", type=str, default="rendition", choices=["rendition", "single_decode", "chunked", "direct"],
+                        help="rendition: one ffmpeg call per rendition, single_decode: one ffmpeg call that decodes the video once for all renditions, audio and thumbnail, chunked: split each rendition in chunks that are encoded in parallel, direct: like single_decode, but encode directly into the dash muxer without intermediate mp4 files")
+    parser.add_argument("--packaging", type=str, default="template", choices=["template", "single_file", "cmaf"],
+                        help="template: one file per segment, single_file: one fragmented mp4 with segment index per representation, cmaf: like template, additionally with hls playlists for the same segments")
+    parser.add_argument("--chunk_duration", type=float, default=60, help="approximate chunk duration in seconds for chunked encoding mode")
+    parser.add_argument("--ladder_policy", type=str, default="drop", choices=["drop", "cap"],
+                        help="handling of renditions above the source resolution, drop: skip them, cap: replace them by one rendition in source resolution")
+    parser.add_argument("--native_top", action="store_true", help="add the source resolution as top rendition")
+    parser.add_argument("--codecs", type=str, default="h264",
+                        help=f"comma separated video codecs, each codec gets its own ladder and adaptation set, available: {', '.join(CODECS)}")
+    parser.add_argument("--rate_control", type=str, default="crf", choices=["crf", "capped_crf"],
+                        help="crf: constant quality, capped_crf: constant quality with a maximum bitrate per rendition (see --target_bitrates)")
+    parser.add_argument("--target_bitrates", type=str, nargs="+", default=None,
+                        help=f"maximum bitrates in kbit/s for capped crf as height:kbps, e.g. 360:800, default: {' '.join(f'{h}:{b}' for h, b in TARGET_BITRATES.items())}")
+    parser.add_argument("--vbv_buffer", type=float, default=1, help="vbv buffer size in seconds of the maximum bitrate for capped crf")
+    parser.add_argument("--peak_ratio_budget", type=float, default=2, help="maximum accepted ratio of peak segment bitrate to average bitrate of a rendition")
+    parser.add_argument("--per_title", action="store_true", help="select heights and crf values of the ladder per video, based on trial encodes of sampled excerpts")
+    parser.add_argument("--per_title_crfs", type=int, nargs="+", default=[22, 26, 30, 34, 38], help="crf values of the trial encodes")
+    parser.add_argument("--per_title_metric", type=str, default="ssim", choices=["ssim", "psnr"], help="quality metric for the per-title analysis")
+    parser.add_argument("--per_title_rungs", type=int, default=None, help="maximum number of renditions of a per-title ladder, default: number of heights")
+    parser.add_argument("--per_title_samples", type=int, default=3, help="number of excerpts used for the trial encodes")
+    parser.add_argument("--per_title_sample_duration", type=float, default=4, help="duration of each excerpt in seconds")
+    parser.add_argument("--progress_json", type=str, default=None, help="append the progress of all ffmpeg jobs as json lines to this file")
+    parser.add_argument("--no_progress", action="store_true", help="don't track the progress of ffmpeg jobs")
+    parser.add_argument("--summary", action="store_true", help="aggregate all encoding reports in the dash folder")
 
-    a = vars(parser.parse_args())
+    a = vars(parser.parse_args(args))
 
     print(f"used cli parmeters: {a}")
+    a["codecs"] = [x.strip() for x in a["codecs"].split(",") if x.strip()]
+    for codec in a["codecs"]:
+        if codec not in CODECS:
+            parser.error(f"unknown codec {codec}, use one of {', '.join(CODECS)}")
+        try:
+            codec_encoder(codec)
+        except RuntimeError as e:
+            parser.error(str(e))
+    a["target_bitrates"] = TARGET_BITRATES if a["target_bitrates"] is None else {
+        int(height): int(bitrate) for height, bitrate in (x.split(":") for x in a["target_bitrates"])
+    }
 
-    if a["auto_subfolders"]:
-        subfolder = os.path.splitext(os.path.basename(a["video"]))[0]
-        a["dash_folder"] = os.path.join(a["dash_folder"], subfolder)
-    os.makedirs(a["dash_folder"], exist_ok=True)
+    videos = collect_videos(a["video"])
+    if len(videos) == 0 and a["summary"]:
+        print(json.dumps(summarize_reports(a["dash_folder"]), indent=4))
+        return
+    if len(videos) == 0:
+        print("no videos to encode")
+        return 1
+    if len(videos) > 1:
+        # each title needs its own folder
+        a["auto_subfolders"] = True
+    names = [os.path.splitext(os.path.basename(x))[0] for x in videos]
+    duplicates = {x for x in names if names.count(x) > 1}
+    if duplicates:
+        parser.error(f"video names must be unique, {', '.join(sorted(duplicates))} are used several times")
 
-    print(f"store dashed video in {a['dash_folder']}")
+    ladders = {}
+    # a broken video must not stop the whole batch
+    failed_titles = []
+    if a["per_title"]:
+        ladders, failed_titles = per_title_ladders(videos, a)
 
-    # TODO: filter out higher resolutions based on input video?!
-    resolutions = [240, 360, 576, 720, 1080] #, 540, 720, 1080] #, 1440, 2160]  # TODO: extend, check, update
+    # all jobs of all titles are scheduled in one global queue,
+    # titles are probed and planned in parallel and their jobs start as soon as a title is planned
+    monitor = None
+    if not a["no_progress"]:
+        monitor = ProgressMonitor(json_file=a["progress_json"])
+        monitor.start()
+    start = time.time()
+    titles = []
+    planned = queue.Queue()
 
-    seg_duration = 2
-    # collect all commands and output files
-    commands = []
-    video_files = []
-    for resolution in resolutions:
-        cmd, outfile = build_video_encode_command(a["video"], a["dash_folder"], resolution, seg_duration=seg_duration)
-        commands.append(cmd)
-        video_files.append(outfile)
-
-    # for audio only one quality is considered
-    # TODO: maybe use more?
-    cmd, audio_file = build_audio_encode_command(a["video"], a["dash_folder"])
-    commands.append(cmd)
-
-    # print("\n".join(commands))
-    # print("\n".join(video_files))
-    # print(audio_file)
-    if not a["no_encoding"]:
-        for x in commands:
-            print(f"run {x}")
-            os.system(x)
-
-    print("create thumbnail")
-    cmd, outfile = build_thumbnail(a["video"], a["dash_folder"])
-    if not os.path.isfile(outfile):
-        os.system(cmd)
-        print(f"thumbnail created {outfile}")
-    else:
-        print(f"thumbnail reused")
-        print(cmd)
+    def plan(video):
+        try:
+            title = plan_title(video, a, ladders.get(video))
+        except Exception as e:
+            print(f"skip {video}, planning failed: {e}")
+            failed_titles.append(video)
+            return
+        titles.append(title)
+        planned.put(title["jobs"])
+
+    with ThreadPoolExecutor(max_workers=a["jobs"]) as planner:
+        futures = [planner.submit(plan, video) for video in videos if video not in failed_titles]
+        # None marks that all titles are planned
+        threading.Thread(target=lambda: (wait(futures), planned.put(None)), daemon=True).start()
+        results = run_jobs([], max_workers=a["jobs"], monitor=monitor, incoming=planned)
+    # report in the input order
+    position = {video: i for i, video in enumerate(videos)}
+    titles.sort(key=lambda title: position[title["video"]])
+    failed_titles.sort(key=position.get)
+    wall_time = time.time() - start
+    if monitor:
+        monitor.stop()
+
+    failed = []
+    for title in titles:
+        update_build_cache(title["build_cache"], title["jobs"], results)
+        save_build_cache(title["build_cache_file"], title["build_cache"])
+        if any(not results[job["name"]].get("cached") for job in title["jobs"]):
+            print(f"report stored in {write_report(title, results)}")
+
+        for job in title["jobs"]:
+            result = results[job["name"]]
+            if result.get("cached"):
+                print(f"{job['name']}: reused")
+                continue
+            print(f"{job['name']}: exit code {result['returncode']}, {result['wall_time']:.2f}s")
+            if result["returncode"] != 0:
+                failed.append(job["name"])
+
+    print("throughput:")
+    for title in titles:
+        executed = [results[job["name"]] for job in title["jobs"] if "start" in results[job["name"]]]
+        if len(executed) == 0:
+            print(f"{title['name']}: everything reused")
+            continue
+        title_wall_time = max(x["end"] for x in executed) - min(x["start"] for x in executed)
+        print(f"{title['name']}: {title['duration']:.1f}s video in {title_wall_time:.1f}s, {title['duration'] / max(title_wall_time, 1e-6):.2f}x realtime")
+    total_duration = sum(title["duration"] for title in titles)
+    print(f"overall: {len(titles)} videos, {total_duration:.1f}s video in {wall_time:.1f}s, {total_duration / max(wall_time, 1e-6):.2f}x realtime")
+
+    # check the bitrate of the delivered segments
+    for title in titles:
+        if not os.path.isfile(title["manifest"]):
+            continue
+        for rendition, values in segment_bitrates(title["manifest"]).items():
+            state = "ok" if values["peak_ratio"] <= a["peak_ratio_budget"] else "exceeds budget"
+            print(f"{title['name']} {rendition}: average {values['average'] / 1000:.0f} kbit/s, peak segment {values['peak'] / 1000:.0f} kbit/s, peak/average {values['peak_ratio']:.2f} ({state})")
+
+    if a["summary"]:
+        print(json.dumps(summarize_reports(a["dash_folder"]), indent=4))
 
-    # print("create manifest file")
-    cmd, outfile = build_manifest_command(a["video"], video_files, [audio_file], a["dash_folder"], seg_duration=seg_duration)
-    # print(cmd)
-    #return
-    os.system(cmd)
+    if failed_titles:
+        print(f"failed titles: {failed_titles}")
+    if failed:
+        print(f"failed jobs: {failed}")
+    if failed or failed_titles:
+        return 1
 
-    print(f"done :-) use {outfile} in your player")
+    for title in titles:
+        print(f"done :-) use {title['manifest']} in your player")
 
 
 if __name__ == "__main__":
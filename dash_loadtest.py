@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+    This file is part of dash_encoder.
+    dash_encoder is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    dash_encoder is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with dash_encoder. If not, see <http://www.gnu.org/licenses/>.
+
+    Author: Steve Göring
+"""
+import argparse
+import sys
+import os
+import glob
+import time
+import random
+import threading
+import http.client
+import urllib.parse
+
+"""
+simple load test for dash_server.py,
+several clients request the segments of all dash videos in parallel
+"""
+
+
+def client(url, paths, deadline, stats, lock, rate_limit=None, keep_alive=False):
+    """
+    Request random `paths` until `deadline`, `rate_limit` simulates a slow connection (bytes per second),
+    with `keep_alive` one connection is used for all requests, as long as the server keeps it open.
+    """
+    parsed = urllib.parse.urlparse(url)
+    connection = None
+    while time.time() < deadline:
+        path = random.choice(paths)
+        start = time.time()
+        try:
+            if connection is None:
+                connection = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=30)
+            connection.request("GET", path)
+            response = connection.getresponse()
+            size = 0
+            while True:
+                data = response.read(65536)
+                if not data:
+                    break
+                size += len(data)
+                if rate_limit:
+                    time.sleep(len(data) / rate_limit)
+            if not keep_alive or response.will_close:
+                connection.close()
+                connection = None
+            ok = response.status in [200, 206, 304]
+        except Exception:
+            ok = False
+            size = 0
+            if connection is not None:
+                connection.close()
+                connection = None
+        with lock:
+            stats["requests"] += 1
+            stats["bytes"] += size
+            stats["errors"] += 0 if ok else 1
+            stats["latencies"].append(time.time() - start)
+
+
+def main(args):
+    # argument parsing
+    parser = argparse.ArgumentParser(description='load test for the dash server',
+                                     epilog="stg7 2019",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:8081", help="url of the running dash server")
+    parser.add_argument("--dash_folder", type=str, default="dash", help="dash folder served by the server, all segments are requested")
+    parser.add_argument("--clients", type=int, default=32, help="number of parallel clients")
+    parser.add_argument("--slow_clients", type=int, default=0, help="number of additional clients with a slow connection")
+    parser.add_argument("--slow_rate", type=int, default=64 * 1024, help="bytes per second of slow clients")
+    parser.add_argument("--duration", type=float, default=10, help="duration of the load test in seconds")
+    parser.add_argument("--keep_alive", action="store_true", help="reuse the connection of a client for all its requests")
+
+    a = vars(parser.parse_args(args))
+    print(f"used cli parmeters: {a}")
+
+    paths = [
+        "/" + x.replace(os.sep, "/")
+        for x in glob.glob(os.path.join(a["dash_folder"], "**", "*.m4s"), recursive=True)
+    ]
+    if len(paths) == 0:
+        print(f"there are no segments in {a['dash_folder']}")
+        return 1
+
+    stats = {"requests": 0, "bytes": 0, "errors": 0, "latencies": []}
+    lock = threading.Lock()
+    deadline = time.time() + a["duration"]
+    threads = [
+        threading.Thread(target=client, args=(a["url"], paths, deadline, stats, lock, None, a["keep_alive"]))
+        for _ in range(a["clients"])
+    ] + [
+        threading.Thread(target=client, args=(a["url"], paths, deadline, stats, lock, a["slow_rate"], a["keep_alive"]))
+        for _ in range(a["slow_clients"])
+    ]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.time() - start
+
+    latencies = sorted(stats["latencies"]) or [0]
+    print(f"requests: {stats['requests']}, errors: {stats['errors']}")
+    print(f"throughput: {stats['requests'] / wall_time:.1f} requests/s, {stats['bytes'] / wall_time / 2**20:.1f} MiB/s")
+    for p in [50, 95, 99]:
+        print(f"latency p{p}: {1000 * latencies[min(len(latencies) - 1, len(latencies) * p // 100)]:.1f} ms")
+    if stats["errors"] > 0:
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -17,8 +17,26 @@
 import argparse
 import sys
 import os
-import glob
 import json
+import signal
+import threading
+import time
+import hashlib
+import mimetypes
+import email.utils
+import ctypes
+import ctypes.util
+import struct
+import functools
+import fnmatch
+import gzip
+import bisect
+import base64
+import socket
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, ServerHandler, make_server
 import bottle
 
 
@@ -30,12 +48,945 @@ def error404(error):
     return 'he is dead jim'
 
 
+class FileRange:
+    """
+    File-like response body for a byte range of an open file,
+    servers with sendfile support pass the file descriptor and range to the kernel,
+    all other servers just read it.
+    """
+    def __init__(self, fp, offset, length):
+        self.fp = fp
+        self.offset = offset
+        self.length = length
+        self._pos = 0
+
+    def fileno(self):
+        return self.fp.fileno()
+
+    def read(self, size=-1):
+        remaining = self.length - self._pos
+        if size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return b""
+        data = os.pread(self.fp.fileno(), size, self.offset + self._pos)
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        self.fp.close()
+
+
+class MemoryRange:
+    """
+    Response body for a byte range of a cached file,
+    servers with sendfile support write the memoryview directly to the socket,
+    all other servers just read it.
+    """
+    def __init__(self, view):
+        self.view = view
+        self._pos = 0
+
+    def read(self, size=-1):
+        remaining = len(self.view) - self._pos
+        if size < 0 or size > remaining:
+            size = remaining
+        data = self.view[self._pos:self._pos + size]
+        self._pos += size
+        # wsgiref only accepts bytes
+        return bytes(data)
+
+
+# Cache-Control header per asset type, can be changed with --cache_policy
+CACHE_POLICY = {
+    # re-encoding or re-packaging a title rewrites segments with the same names,
+    # so they are revalidated (ETag) after a short time, to match the manifest again
+    "segment": "public, max-age=60",
+    "manifest": "public, max-age=2, stale-while-revalidate=30",
+    "index": "public, max-age=10, stale-while-revalidate=60",
+    "thumbnail": "public, max-age=3600, stale-while-revalidate=86400",
+    "default": "public, max-age=60",
+}
+# file name patterns of the asset types, the first matching pattern is used
+ASSET_PATTERNS = [
+    ("segment", "init-stream*.m4s"),
+    ("segment", "chunk-stream*.m4s"),
+    # single file packaging
+    ("segment", "*-stream*.mp4"),
+    ("manifest", "*.mpd"),
+    ("manifest", "*.m3u8"),
+    ("index", "video_index.js"),
+    ("thumbnail", "*_thumb.png"),
+]
+
+
+def asset_type(filename):
+    """
+    Asset type of `filename` for the cache policy, precompressed variants have the type of the original file.
+    """
+    name = os.path.basename(filename)
+    for extension in [".gz", ".br"]:
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+    for asset, pattern in ASSET_PATTERNS:
+        if fnmatch.fnmatchcase(name, pattern):
+            return asset
+    return "default"
+
+
+class MultiRange:
+    """
+    Response body for multipart/byteranges responses,
+    `parts` are FileRange and MemoryRange objects with the part headers and the requested ranges,
+    servers with sendfile support send every part directly, all other servers just read it.
+    """
+    def __init__(self, parts):
+        self.parts = parts
+        self._index = 0
+
+    def read(self, size=-1):
+        while self._index < len(self.parts):
+            data = self.parts[self._index].read(size)
+            if data:
+                return data
+            self._index += 1
+        return b""
+
+    def close(self):
+        for part in self.parts:
+            if isinstance(part, FileRange):
+                part.close()
+
+
+def file_metadata(filename, charset='UTF-8'):
+    """
+    Collect all metadata needed to serve `filename`, the same checks as in `bottle.static_file` are used.
+    @return dict with metadata, or an error code (404 or 403)
+    """
+    if not os.path.exists(filename) or not os.path.isfile(filename):
+        return 404
+    if not os.access(filename, os.R_OK):
+        return 403
+    headers = dict()
+    mimetype, encoding = mimetypes.guess_type(filename)
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    if mimetype:
+        if (mimetype[:5] == 'text/' or mimetype == 'application/javascript') and charset and 'charset' not in mimetype:
+            mimetype += '; charset=%s' % charset
+        headers['Content-Type'] = mimetype
+
+    stats = os.stat(filename)
+    headers['Last-Modified'] = email.utils.formatdate(stats.st_mtime, usegmt=True)
+    etag = '%d:%d:%d:%d:%s' % (stats.st_dev, stats.st_ino, stats.st_mtime, stats.st_size, filename)
+    headers['ETag'] = hashlib.sha1(etag.encode()).hexdigest()
+    headers['Cache-Control'] = CACHE_POLICY.get(asset_type(filename), CACHE_POLICY["default"])
+    return {
+        "size": stats.st_size,
+        "mtime": stats.st_mtime,
+        "headers": headers
+    }
+
+
+class FileMetaCache:
+    """
+    LRU cache for the metadata of served files.
+    Entries of files in watched folders are invalidated via inotify (watches are not recursive,
+    so every folder has its own watch), all other entries (or all, if inotify is not available)
+    expire after `ttl` seconds.
+    """
+    # inotify event masks, see `man inotify`
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+    def __init__(self, max_entries=10000, ttl=5):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._watched = {}  # watch descriptor -> folder, only used with the lock
+        self._watched_folders = set()  # folders with a watch, only used with the lock
+        # incremented by every invalidation, metadata read during an invalidation is not stored
+        self._generation = 0
+        self._inotify_fd = None
+        self._libc = None
+
+    def get(self, filename):
+        """
+        Metadata of `filename`, see `file_metadata`.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is not None and (entry[1] is None or entry[1] > now):
+                self._entries.move_to_end(filename)
+                return entry[0]
+            generation = self._generation
+        meta = file_metadata(filename)
+        if isinstance(meta, dict):
+            with self._lock:
+                if generation != self._generation:
+                    # the file may have changed after it was read
+                    return meta
+                watched = os.path.join(os.path.dirname(filename), '') in self._watched_folders
+                self._entries[filename] = (meta, None if watched else now + self.ttl)
+                self._entries.move_to_end(filename)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return meta
+
+    def invalidate(self, path=None):
+        """
+        Remove `path` (a file or a folder) from the cache, all entries if `path` is None.
+        """
+        with self._lock:
+            self._generation += 1
+            if path is None:
+                self._entries.clear()
+                return
+            self._entries.pop(path, None)
+            prefix = os.path.join(path, '')
+            for filename in [x for x in self._entries if x.startswith(prefix)]:
+                del self._entries[filename]
+
+    def _add_watch(self, folder):
+        wd = self._libc.inotify_add_watch(self._inotify_fd, os.fsencode(folder), self.WATCH_MASK)
+        if wd < 0:
+            # e.g. ENOSPC if fs.inotify.max_user_watches is reached
+            print(f"can not watch {folder}: {os.strerror(ctypes.get_errno())}, files expire after {self.ttl}s")
+            return
+        with self._lock:
+            self._watched[wd] = os.path.join(folder, '')
+            self._watched_folders.add(os.path.join(folder, ''))
+
+    def _add_watches(self, folder):
+        # only folders are listed, the files of a folder are not needed
+        folders = [folder]
+        while folders:
+            folder = folders.pop()
+            self._add_watch(folder)
+            try:
+                with os.scandir(folder) as entries:
+                    folders.extend(entry.path for entry in entries if entry.is_dir(follow_symlinks=False))
+            except OSError:
+                continue
+
+    def watch(self, folder):
+        """
+        Watch `folder` and all subfolders with inotify, returns False if inotify is not available.
+        The watches are added in a background thread, until then the files expire after `ttl` seconds.
+        """
+        if self._inotify_fd is None:
+            try:
+                self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+                self._inotify_fd = self._libc.inotify_init()
+            except (OSError, AttributeError):
+                self._inotify_fd = -1
+            if self._inotify_fd < 0:
+                print("inotify is not available, use ttl based invalidation")
+                return False
+            threading.Thread(target=self._read_events, daemon=True).start()
+        threading.Thread(target=self._add_watches, args=(os.path.abspath(folder),), daemon=True).start()
+        return True
+
+    def _read_events(self):
+        header = struct.calcsize("iIII")
+        while True:
+            data = os.read(self._inotify_fd, 64 * 1024)
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = struct.unpack_from("iIII", data, pos)
+                name = data[pos + header:pos + header + length].rstrip(b"\0")
+                pos += header + length
+                if mask & self.IN_Q_OVERFLOW:
+                    # events are lost, so nothing in the cache can be trusted
+                    self.invalidate()
+                    continue
+                with self._lock:
+                    folder = self._watched.get(wd)
+                    if mask & self.IN_IGNORED:
+                        self._watched.pop(wd, None)
+                        self._watched_folders.discard(folder)
+                        continue
+                if folder is None:
+                    continue
+                path = os.path.join(folder, os.fsdecode(name)) if name else folder.rstrip(os.sep)
+                self.invalidate(path)
+                if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    self._add_watches(path)
+
+
+file_meta_cache = FileMetaCache()
+
+
+class SegmentCache:
+    """
+    In-memory cache for the content of frequently requested files with a byte budget.
+    New files are only admitted if they were requested more often than the
+    least recently used files that would have to be evicted (TinyLFU),
+    the request frequencies are estimated with a count-min sketch that is halved periodically.
+    """
+    DEPTH = 4
+
+    def __init__(self, max_bytes=0, max_item_bytes=8 * 1024 * 1024, width=2 ** 16):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()  # filename -> (etag, data)
+        self._lock = threading.Lock()
+        self._width = width
+        self._sketch = [[0] * width for _ in range(self.DEPTH)]
+        self._samples = 0
+        self.stats = {"hits": 0, "misses": 0, "admissions": 0, "rejections": 0, "evictions": 0}
+
+    def _cells(self, filename):
+        return [(row, hash((row, filename)) % self._width) for row in range(self.DEPTH)]
+
+    def _frequency(self, filename):
+        return min(self._sketch[row][col] for row, col in self._cells(filename))
+
+    def _record(self, filename):
+        for row, col in self._cells(filename):
+            self._sketch[row][col] += 1
+        self._samples += 1
+        if self._samples >= 10 * self._width:
+            # aging, so that formerly popular files can be replaced
+            for row in self._sketch:
+                row[:] = [x >> 1 for x in row]
+            self._samples //= 2
+
+    def get(self, filename, meta):
+        """
+        Cached content of `filename` as memoryview, None if the file is not cached.
+        Every call counts as request for the admission policy.
+        """
+        if self.max_bytes <= 0:
+            return None
+        with self._lock:
+            self._record(filename)
+            entry = self._entries.get(filename)
+            if entry is not None:
+                if entry[0] == meta["headers"]["ETag"]:
+                    self._entries.move_to_end(filename)
+                    self.stats["hits"] += 1
+                    return memoryview(entry[1])
+                # file was changed
+                del self._entries[filename]
+                self.bytes -= len(entry[1])
+            self.stats["misses"] += 1
+            return None
+
+    def _admit(self, filename, size):
+        """
+        Evict files for `size` new bytes, if `filename` is more popular than the evicted files.
+        """
+        if size > min(self.max_item_bytes, self.max_bytes):
+            return False
+        frequency = self._frequency(filename)
+        victims = []
+        free = self.max_bytes - self.bytes
+        for victim, (_, data) in self._entries.items():
+            if free >= size:
+                break
+            if self._frequency(victim) >= frequency:
+                return False
+            victims.append(victim)
+            free += len(data)
+        for victim in victims:
+            self.bytes -= len(self._entries.pop(victim)[1])
+        self.stats["evictions"] += len(victims)
+        return True
+
+    def add(self, filename, meta, fp):
+        """
+        Read the content of `filename` from the open file `fp` into the cache, if it is admitted.
+        @return content as memoryview or None
+        """
+        if self.max_bytes <= 0:
+            return None
+        size = meta["size"]
+        with self._lock:
+            if not self._admit(filename, size):
+                self.stats["rejections"] += 1
+                return None
+            # reserve the space, so that concurrent requests respect the budget
+            self.bytes += size
+        data = os.pread(fp.fileno(), size, 0)
+        with self._lock:
+            old = self._entries.pop(filename, None)
+            if old is not None:
+                self.bytes -= len(old[1])
+            self._entries[filename] = (meta["headers"]["ETag"], data)
+            self.bytes += len(data) - size
+            self.stats["admissions"] += 1
+        return memoryview(data)
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, files=len(self._entries), bytes=self.bytes, max_bytes=self.max_bytes)
+
+
+segment_cache = SegmentCache()
+
+
+class VideoIndex:
+    """
+    Persistent index of all dash videos in the subfolders of `dash_folder`.
+    The index is stored in `state_file` together with the modification time of every subfolder,
+    so a rescan only reads subfolders that were changed, added or removed since the last scan.
+    """
+    def __init__(self, dash_folder, index_file, state_file):
+        self.dash_folder = dash_folder
+        self.index_file = index_file
+        self.state_file = state_file
+        self.folders = {}  # subfolder -> {"mtime": .., "videos": [..]}
+        # etag, videos and manifests are published together, readers take one consistent snapshot
+        self.snapshot = ("", [], [])
+        self._lock = threading.Lock()
+
+    @property
+    def etag(self):
+        return self.snapshot[0]
+
+    @property
+    def videos(self):
+        return self.snapshot[1]
+
+    @property
+    def manifests(self):
+        return self.snapshot[2]
+
+    def load(self):
+        """
+        Load the last known index, the index file is only written if it does not exist.
+        """
+        if os.path.isfile(self.state_file):
+            with open(self.state_file) as sfp:
+                state = json.load(sfp)
+            if state.get("dash_folder") == self.dash_folder:
+                self.folders = state["folders"]
+        self._update_videos()
+        if not os.path.isfile(self.index_file):
+            self._write()
+        print(f"there are {len(self.videos)} dash videos in the last known index")
+
+    @staticmethod
+    def scan_folder(folder):
+        """
+        Find the dash videos in `folder`.
+        @return list of videos, videos without a thumbnail are skipped
+        """
+        files = sorted(os.listdir(folder))
+        thumbnails = [x for x in files if x.endswith("_thumb.png")]
+        videos = []
+        for manifest in [x for x in files if x.endswith(".mpd")]:
+            if not thumbnails:
+                print(f"{manifest} has no thumbnail yet")
+                continue
+            video = {
+                "thumbail": os.path.join(folder, thumbnails[0]),
+                "name": os.path.splitext(manifest)[0],
+                "manifest": os.path.join(folder, manifest)
+            }
+            # hls master playlist of cmaf packaged videos
+            master = manifest.replace("_manifest.mpd", "_master.m3u8")
+            if master in files:
+                video["hls"] = os.path.join(folder, master)
+            videos.append(video)
+        return videos
+
+    def scan(self):
+        """
+        Rescan all changed subfolders, the index file is rewritten if the index was changed.
+        @return True if the index was changed
+        """
+        mtimes = {}
+        if os.path.isdir(self.dash_folder):
+            for entry in os.scandir(self.dash_folder):
+                if entry.is_dir():
+                    mtimes[os.path.join(self.dash_folder, entry.name)] = entry.stat().st_mtime_ns
+
+        changed = False
+        folders = dict(self.folders)
+        for folder in set(folders) - set(mtimes):
+            print(f"{folder} was removed")
+            del folders[folder]
+            changed = True
+        for folder, mtime in mtimes.items():
+            if folder in folders and folders[folder]["mtime"] == mtime:
+                continue
+            try:
+                videos = self.scan_folder(folder)
+            except OSError:
+                continue
+            folders[folder] = {"mtime": mtime, "videos": videos}
+            changed = True
+        if not changed:
+            return False
+
+        with self._lock:
+            self.folders = folders
+            self._update_videos()
+        self._write()
+        print(f"index updated, there are {len(self.videos)} dash videos")
+        return True
+
+    def _update_videos(self):
+        videos = sorted((video for folder in self.folders.values() for video in folder["videos"]), key=lambda x: x["manifest"])
+        # readers use the snapshot without lock, so it is replaced with one assignment and never modified
+        self.snapshot = (
+            hashlib.sha1(json.dumps(videos).encode()).hexdigest(),
+            videos,
+            [video["manifest"] for video in videos]
+        )
+
+    def page(self, cursor=None, limit=50, snapshot=None):
+        """
+        Videos after `cursor` (the manifest of the last video of the previous page) in manifest order.
+        @param snapshot snapshot of the index that is used, default the current one
+        @return list of videos and cursor of the next page or None
+        """
+        _, videos, manifests = snapshot or self.snapshot
+        start = bisect.bisect_right(manifests, cursor) if cursor else 0
+        page = videos[start:start + limit]
+        if start + limit >= len(videos):
+            return page, None
+        return page, page[-1]["manifest"]
+
+    def _write(self):
+        # write to temporary files, so that clients never read partial files
+        with open(self.index_file + ".tmp", "w") as idx_fp:
+            idx_fp.write("var video_index =\n")
+            idx_fp.write(json.dumps(self.videos, indent=4) + ";\n")
+        os.replace(self.index_file + ".tmp", self.index_file)
+        with open(self.index_file, "rb") as idx_fp, open(self.index_file + ".gz.tmp", "wb") as gz_fp:
+            gz_fp.write(gzip.compress(idx_fp.read(), 9))
+        os.replace(self.index_file + ".gz.tmp", self.index_file + ".gz")
+        with open(self.state_file + ".tmp", "w") as sfp:
+            json.dump({"dash_folder": self.dash_folder, "folders": self.folders}, sfp)
+        os.replace(self.state_file + ".tmp", self.state_file)
+
+    def start(self, interval=10):
+        """
+        Rescan the dash folder every `interval` seconds in a background thread.
+        """
+        def rescan():
+            while True:
+                try:
+                    self.scan()
+                except OSError as e:
+                    print(f"rescan of {self.dash_folder} failed: {e}")
+                time.sleep(interval)
+
+        threading.Thread(target=rescan, daemon=True).start()
+
+
+video_index = VideoIndex("dash", "video_index.js", "video_index_state.json")
+
+
+# content encodings of precompressed files, in order of preference, e.g. `<manifest>.mpd.br`
+PRECOMPRESSED_VARIANTS = [("br", ".br"), ("gzip", ".gz")]
+PRECOMPRESSED_EXTENSIONS = (".mpd", ".m3u8", ".js", ".json")
+
+
+def accepted_encodings(accept_encoding):
+    """
+    Content encodings of an Accept-Encoding header, without encodings with q=0.
+    """
+    encodings = set()
+    for part in accept_encoding.split(","):
+        encoding, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q=") and params[2:].strip("0.") == "":
+            continue
+        encodings.add(encoding.strip().lower())
+    return encodings
+
+
+def precompressed_variant(filename, meta, cache):
+    """
+    Select the best precompressed variant of `filename` that is accepted by the client,
+    variants that are older than `filename` are ignored.
+    @return filename and metadata of the variant, or `filename` and `meta` if there is none
+    """
+    accept_encoding = bottle.request.environ.get('HTTP_ACCEPT_ENCODING')
+    if not accept_encoding:
+        return filename, meta
+    accepted = accepted_encodings(accept_encoding)
+    for encoding, extension in PRECOMPRESSED_VARIANTS:
+        if encoding not in accepted:
+            continue
+        variant = cache.get(filename + extension)
+        if isinstance(variant, dict) and variant["mtime"] >= meta["mtime"]:
+            # mimetypes only knows .br since python 3.9, so the encoding is not guessed from the file name,
+            # the content type is the one of the original file, the variant keeps its own ETag
+            headers = dict(variant["headers"])
+            headers.pop("Content-Type", None)
+            if "Content-Type" in meta["headers"]:
+                headers["Content-Type"] = meta["headers"]["Content-Type"]
+            headers["Content-Encoding"] = encoding
+            return filename + extension, dict(variant, headers=headers)
+    return filename, meta
+
+
+# requests with more ranges are answered with the full file
+MAX_RANGES = 100
+
+
+def merge_ranges(ranges):
+    """
+    Sort the ranges (start, end) and join overlapping or adjacent ranges.
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+@functools.lru_cache()
+def root_path(root):
+    return os.path.join(os.path.abspath(root), '')
+
+
+def serve_file(filename, root, cache=file_meta_cache, content_cache=segment_cache):
+    """
+    Same as `bottle.static_file`, however the body is a FileRange, so that it can be sent with sendfile,
+    and the metadata of the file is cached.
+    Frequently requested files are served from `content_cache`,
+    for manifests and indexes precompressed variants are served if the client accepts them.
+    """
+    root = root_path(root)
+    filename = os.path.normpath(os.path.join(root, filename.strip('/\\')))
+
+    if not filename.startswith(root):
+        return bottle.HTTPError(403, "Access denied.")
+    meta = cache.get(filename)
+    if meta == 404:
+        return bottle.HTTPError(404, "File does not exist.")
+    if meta == 403:
+        return bottle.HTTPError(403, "You do not have permission to access this file.")
+
+    compressible = filename.endswith(PRECOMPRESSED_EXTENSIONS)
+    if compressible:
+        filename, meta = precompressed_variant(filename, meta, cache)
+
+    headers = dict(meta["headers"])
+    if compressible:
+        headers["Vary"] = "Accept-Encoding"
+    headers['Content-Length'] = clen = meta["size"]
+    headers['Date'] = email.utils.formatdate(time.time(), usegmt=True)
+
+    getenv = bottle.request.environ.get
+    if getenv('HTTP_IF_NONE_MATCH') == headers['ETag']:
+        return bottle.HTTPResponse(status=304, **headers)
+
+    ims = getenv('HTTP_IF_MODIFIED_SINCE')
+    if ims:
+        ims = bottle.parse_date(ims.split(";")[0].strip())
+    if ims is not None and ims >= int(meta["mtime"]):
+        return bottle.HTTPResponse(status=304, **headers)
+
+    headers["Accept-Ranges"] = "bytes"
+    ranges, status = [(0, clen)], 200
+    range_header = getenv('HTTP_RANGE')
+    if range_header:
+        requested = merge_ranges(bottle.parse_range_header(range_header, clen))
+        if not requested:
+            return bottle.HTTPError(416, "Requested Range Not Satisfiable")
+        if len(requested) <= MAX_RANGES:
+            ranges, status = requested, 206
+    if status == 206 and len(ranges) == 1:
+        offset, end = ranges[0]
+        headers["Content-Range"] = "bytes %d-%d/%d" % (offset, end - 1, clen)
+        headers["Content-Length"] = str(end - offset)
+    elif status == 206:
+        # multipart/byteranges, see RFC 7233, the ETag is unique for the file, so it is used as boundary
+        boundary = meta["headers"]["ETag"]
+        part_type = f"Content-Type: {headers['Content-Type']}\r\n" if "Content-Type" in headers else ""
+        part_headers = [
+            f"\r\n--{boundary}\r\n{part_type}Content-Range: bytes {offset}-{end - 1}/{clen}\r\n\r\n".encode()
+            for offset, end in ranges
+        ]
+        trailer = f"\r\n--{boundary}--\r\n".encode()
+        headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+        headers["Content-Length"] = str(sum(len(x) for x in part_headers) + sum(end - offset for offset, end in ranges) + len(trailer))
+
+    if bottle.request.method == 'HEAD':
+        return bottle.HTTPResponse('', status=status, **headers)
+    content = content_cache.get(filename, meta)
+    fp = None
+    if content is None:
+        try:
+            fp = open(filename, 'rb')
+        except OSError:
+            # file was removed in the meantime
+            cache.invalidate(filename)
+            return bottle.HTTPError(404, "File does not exist.")
+        content = content_cache.add(filename, meta, fp)
+        if content is not None:
+            fp.close()
+
+    def part(offset, end):
+        if content is not None:
+            return MemoryRange(content[offset:end])
+        return FileRange(fp, offset, end - offset)
+
+    if len(ranges) == 1:
+        return bottle.HTTPResponse(part(*ranges[0]), status=status, **headers)
+    parts = []
+    for part_header, (offset, end) in zip(part_headers, ranges):
+        parts += [MemoryRange(memoryview(part_header)), part(offset, end)]
+    parts.append(MemoryRange(memoryview(trailer)))
+    return bottle.HTTPResponse(MultiRange(parts), status=status, **headers)
+
+
+@app.route('/_stats')
+def stats():
+    '''
+    Counters of the segment cache
+    '''
+    return {"segment_cache": segment_cache.info()}
+
+
+# precompressed responses of the video api, (etag, cursor, limit, fields) -> (etag, body, gzip body)
+api_responses = OrderedDict()
+api_responses_lock = threading.Lock()
+API_VIDEO_FIELDS = ["name", "thumbail", "manifest", "hls"]
+
+
+@app.route('/api/videos')
+def api_videos():
+    '''
+    Paginated video index,
+    `cursor` is taken from `next` of the previous page, `limit` is the page size and
+    `fields` a comma separated list of the returned fields.
+    '''
+    query = bottle.request.query
+    try:
+        limit = min(max(int(query.get("limit", 50)), 1), 500)
+        cursor = base64.urlsafe_b64decode(query.get("cursor", "")).decode() if query.get("cursor") else None
+    except ValueError:
+        return bottle.HTTPError(400, "Invalid limit or cursor.")
+    fields = [x for x in query.get("fields", ",".join(API_VIDEO_FIELDS)).split(",") if x in API_VIDEO_FIELDS]
+
+    snapshot = video_index.snapshot
+    key = (snapshot[0], cursor, limit, tuple(fields))
+    with api_responses_lock:
+        response = api_responses.get(key)
+        if response is not None:
+            api_responses.move_to_end(key)
+    if response is None:
+        page, next_cursor = video_index.page(cursor, limit, snapshot)
+        body = json.dumps({
+            "videos": [{field: video[field] for field in fields if field in video} for video in page],
+            "next": base64.urlsafe_b64encode(next_cursor.encode()).decode() if next_cursor else None,
+            "total": len(snapshot[1])
+        }).encode()
+        etag = hashlib.sha1(body).hexdigest()
+        response = (etag, body, gzip.compress(body))
+        with api_responses_lock:
+            api_responses[key] = response
+            while len(api_responses) > 1000:
+                api_responses.popitem(last=False)
+
+    etag, body, gzip_body = response
+    headers = {"Content-Type": "application/json", "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if "gzip" in accepted_encodings(bottle.request.environ.get("HTTP_ACCEPT_ENCODING", "")):
+        body = gzip_body
+        headers["Content-Encoding"] = "gzip"
+        etag += "-gz"
+    headers["ETag"] = etag
+    if bottle.request.environ.get("HTTP_IF_NONE_MATCH") == headers["ETag"]:
+        return bottle.HTTPResponse(status=304, **headers)
+    headers["Content-Length"] = len(body)
+    return bottle.HTTPResponse(body, **headers)
+
+
 @app.route('/<filename:path>')
 def static(filename):
     '''
     Serve static files
     '''
-    return bottle.static_file(filename, root='.')
+    return serve_file(filename, root='.')
+
+
+class PoolWSGIServer(WSGIServer):
+    """
+    WSGI server that handles requests with a fixed number of worker threads,
+    so that one slow client does not block all other clients.
+    """
+    workers = 32
+    _pool = None
+
+    def server_activate(self):
+        super().server_activate()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers)
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        # same as socketserver.ThreadingMixIn
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        # wait for all requests that are currently handled
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+
+class SendfileHandler(ServerHandler):
+    """
+    wsgiref handler that sends file bodies with os.sendfile,
+    so the data is copied by the kernel directly from the file to the socket.
+    """
+    def sendfile(self):
+        body = self.result.filelike
+        if isinstance(body, MultiRange):
+            parts = body.parts
+        elif isinstance(body, (FileRange, MemoryRange)):
+            parts = [body]
+        elif hasattr(body, "fileno") and hasattr(body, "tell"):
+            offset = body.tell()
+            parts = [FileRange(body, offset, os.fstat(body.fileno()).st_size - offset)]
+        else:
+            return False
+        if not self.headers_sent:
+            self.send_headers()
+        self._flush()
+        sock = self.request_handler.connection
+        for part in parts:
+            if isinstance(part, MemoryRange):
+                sock.sendall(part.view)
+                self.bytes_sent += len(part.view)
+                continue
+            offset, remaining = part.offset, part.length
+            while remaining > 0:
+                sent = os.sendfile(sock.fileno(), part.fileno(), offset, remaining)
+                if sent == 0:
+                    break
+                offset += sent
+                remaining -= sent
+                self.bytes_sent += sent
+        return True
+
+    def cleanup_headers(self):
+        super().cleanup_headers()
+        # without a length the end of the response is the end of the connection
+        if "Content-Length" not in self.headers:
+            self.request_handler.close_connection = True
+        if self.request_handler.close_connection:
+            if self.request_handler.request_version == "HTTP/1.1":
+                self.headers["Connection"] = "close"
+        elif self.request_handler.request_version == "HTTP/1.0":
+            self.headers["Connection"] = "keep-alive"
+
+    def handle_error(self):
+        # the response may be incomplete, so the connection can not be reused
+        self.request_handler.close_connection = True
+        super().handle_error()
+
+
+class SendfileWSGIRequestHandler(WSGIRequestHandler):
+    """
+    wsgiref request handler with SendfileHandler, with `protocol_version` HTTP/1.1 connections
+    are kept alive for several requests, idle connections are closed after `keep_alive_timeout` seconds.
+    """
+    keep_alive_timeout = None
+
+    # loop over all requests of a connection until close_connection is set
+    handle = BaseHTTPRequestHandler.handle
+
+    def handle_one_request(self):
+        # same as WSGIRequestHandler.handle, but with SendfileHandler
+        self.connection.settimeout(self.keep_alive_timeout)
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+            if not self.raw_requestline:
+                self.close_connection = True
+                return
+            if len(self.raw_requestline) > 65536:
+                self.requestline = ''
+                self.request_version = ''
+                self.command = ''
+                self.send_error(414)
+                return
+
+            if not self.parse_request():
+                return
+        except socket.timeout:
+            self.close_connection = True
+            return
+        finally:
+            # sendfile needs a blocking socket
+            self.connection.settimeout(None)
+
+        if self.headers.get("Content-Length", "0") != "0" or "Transfer-Encoding" in self.headers:
+            # request bodies are not always read completely, then the next request can not be parsed
+            self.close_connection = True
+
+        handler = SendfileHandler(
+            self.rfile, self.wfile, self.get_stderr(), self.get_environ(),
+            multithread=True,
+        )
+        handler.http_version = self.protocol_version.split("/")[1]
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+
+class QuietWSGIRequestHandler(SendfileWSGIRequestHandler):
+    def log_request(self, *args, **kw):
+        pass
+
+
+class ProductionServer(bottle.ServerAdapter):
+    """
+    Multi-threaded server without debug mode and reloader, connections are kept alive (HTTP/1.1),
+    on SIGTERM/SIGINT no new connections are accepted and running requests are finished.
+    """
+    def run(self, handler):
+        workers = self.options.get("workers", 32)
+        server_class = type("Server", (PoolWSGIServer,), {"workers": workers, "request_queue_size": 1024})
+        handler_class = SendfileWSGIRequestHandler if self.options.get("access_log") else QuietWSGIRequestHandler
+        keep_alive_timeout = self.options.get("keep_alive_timeout", 5)
+        if keep_alive_timeout > 0:
+            handler_class = type("Handler", (handler_class,), {
+                "protocol_version": "HTTP/1.1",
+                "keep_alive_timeout": keep_alive_timeout,
+                # headers and body are separate writes, with nagle the body of a reused connection waits for a delayed ack
+                "disable_nagle_algorithm": True
+            })
+        server = make_server(self.host, self.port, handler, server_class, handler_class)
+
+        def drain(signum, frame):
+            print("shutdown server, finish running requests")
+            # shutdown() blocks until serve_forever is stopped, so it needs its own thread
+            threading.Thread(target=server.shutdown).start()
+
+        signal.signal(signal.SIGTERM, drain)
+        signal.signal(signal.SIGINT, drain)
+        print(f"serve on http://{self.host}:{self.port} with {workers} worker threads")
+        server.serve_forever()
+        server.server_close()
 
 
 @app.route('/')
@@ -54,30 +1005,58 @@ def main(_):
     parser.add_argument("--dash_folder", type=str, default="dash", help="folder for storing the dash video")
     parser.add_argument("--index_file", type=str, default="video_index.js", help="file where all videos are stored as javascript json object")
     parser.add_argument("--webserver_port", type=int, default=8081, help="webserver port")
+    parser.add_argument("--index_state_file", type=str, default="video_index_state.json", help="file where the state of the index is stored between restarts")
+    parser.add_argument("--rescan_interval", type=float, default=10, help="seconds between two rescans of the dash folder for new or removed videos")
+    parser.add_argument("--production", action="store_true", help="use a multi-threaded server without debug mode and reloader")
+    parser.add_argument("--workers", type=int, default=32, help="number of worker threads in production mode")
+    parser.add_argument("--access_log", action="store_true", help="log every request in production mode")
+    parser.add_argument("--keep_alive_timeout", type=float, default=5,
+                        help="seconds an idle connection is kept open in production mode, 0 closes the connection after every request (HTTP/1.0)")
+    parser.add_argument("--meta_cache_size", type=int, default=10000, help="maximum number of files with cached metadata")
+    parser.add_argument("--meta_cache_ttl", type=float, default=5, help="seconds until cached metadata expires, if the file is not watched via inotify")
+    parser.add_argument("--cache_policy", type=str, default=None, help="json file with Cache-Control headers per asset type (segment, manifest, index, thumbnail, default)")
+    parser.add_argument("--segment_cache_mb", type=float, default=0, help="memory budget in MiB for caching frequently requested files, 0 disables the cache")
+    parser.add_argument("--segment_cache_max_file_mb", type=float, default=8, help="maximum size in MiB of a single cached file")
 
 
     a = vars(parser.parse_args())
     print(f"used cli parmeters: {a}")
 
-    manifest_files = list(glob.glob(a["dash_folder"] + "/*/*.mpd"))
-    print(f"there are {len(manifest_files)} dash videos stored, build index")
-
-    videos = []
-    for manifest in manifest_files:
-        print(f"handle {manifest}")
-        thumbail = list(glob.glob(os.path.dirname(manifest) + "/*_thumb.png"))[0]
-        name = os.path.splitext(os.path.basename(manifest))[0]
-        video = {
-            "thumbail": thumbail,
-            "name": name,
-            "manifest": manifest
-        }
-        print(video)
-        videos.append(video)
-
-    with open(a["index_file"], "w") as idx_fp:
-        idx_fp.write("var video_index =\n")
-        idx_fp.write(json.dumps(videos, indent=4) + ";\n")
+    video_index.dash_folder = a["dash_folder"]
+    video_index.index_file = a["index_file"]
+    video_index.state_file = a["index_state_file"]
+    # with the reloader, main also runs in the parent process that only restarts the serving child process,
+    # the index and the file watcher are only needed in the serving process
+    serving = a["production"] or "BOTTLE_CHILD" in os.environ
+    if serving:
+        video_index.load()
+        video_index.start(a["rescan_interval"])
+
+    if a["cache_policy"]:
+        with open(a["cache_policy"]) as pfp:
+            CACHE_POLICY.update(json.load(pfp))
+    ASSET_PATTERNS.insert(0, ("index", os.path.basename(a["index_file"])))
+
+    file_meta_cache.max_entries = a["meta_cache_size"]
+    file_meta_cache.ttl = a["meta_cache_ttl"]
+    if serving:
+        file_meta_cache.watch(a["dash_folder"])
+    segment_cache.max_bytes = int(a["segment_cache_mb"] * 1024 * 1024)
+    segment_cache.max_item_bytes = int(a["segment_cache_max_file_mb"] * 1024 * 1024)
+
+    if a["production"]:
+        bottle.run(
+            app=app,
+            server=ProductionServer(
+                host='0.0.0.0',
+                port=a["webserver_port"],
+                workers=a["workers"],
+                access_log=a["access_log"],
+                keep_alive_timeout=a["keep_alive_timeout"]
+            ),
+            quiet=True
+        )
+        return
 
     bottle.run(
         app=app,
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+    This file is part of dash_encoder.
+    dash_encoder is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    dash_encoder is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with dash_encoder. If not, see <http://www.gnu.org/licenses/>.
+
+    Author: Steve Göring
+"""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import dash_encoder
+
+"""
+tests of the helper functions that do not need ffmpeg, run with `python3 -m unittest test_dash`
+"""
+
+
+class ChunkBoundariesTest(unittest.TestCase):
+    def boundaries(self, duration, chunk_duration, keyframes=None, fps="25/1"):
+        meta = {"fps": fps, "duration": duration, "keyframes": keyframes or []}
+        with mock.patch.object(dash_encoder, "probe", return_value=meta):
+            return dash_encoder.chunk_boundaries("video.mp4", seg_duration=2, chunk_duration=chunk_duration)
+
+    def assert_covers(self, chunks, total_frames, keyint=50):
+        self.assertEqual(chunks[0][0], 0)
+        for (start, frames), (next_start, _) in zip(chunks, chunks[1:]):
+            self.assertEqual(start + frames, next_start)
+            self.assertEqual(next_start % keyint, 0)
+        self.assertEqual(chunks[-1][0] + chunks[-1][1], total_frames)
+
+    def test_chunks_cover_video(self):
+        chunks = self.boundaries(60, 10)
+        self.assert_covers(chunks, 1500)
+        self.assertEqual([start for start, _ in chunks], [0, 250, 500, 750, 1000, 1250])
+
+    def test_chunk_of_one_segment_terminates(self):
+        # every segment start is a source keyframe, the previous start must never be selected again
+        chunks = self.boundaries(10, 2, keyframes=[2 * i for i in range(6)])
+        self.assert_covers(chunks, 250)
+        self.assertEqual(len(chunks), 4)
+
+    def test_prefer_source_keyframes(self):
+        chunks = self.boundaries(60, 20, keyframes=[0, 22])
+        self.assertEqual(chunks[1][0], 550)
+        self.assert_covers(chunks, 1500)
+
+
+class PlanBuildTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(dash_encoder, "encoder_version", return_value="ffmpeg version test")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+
+    def output(self, name, create=True):
+        filename = os.path.join(self.folder.name, name)
+        if create:
+            open(filename, "w").close()
+        return filename
+
+    def jobs(self, cmd="encode"):
+        return [
+            {"name": "chunk0", "cmd": f"{cmd} 0", "outputs": [self.output("chunk0", False)], "intermediate": True},
+            {"name": "video", "cmd": "concat", "outputs": [self.output("video.mp4")], "after": ["chunk0"]},
+            {"name": "manifest", "cmd": "dash", "outputs": [self.output("manifest.mpd")], "after": ["video"]},
+        ]
+
+    def test_up_to_date(self):
+        jobs = self.jobs()
+        dash_encoder.plan_build(jobs, {}, "hash")
+        cache = {output: job["key"] for job in jobs for output in job["outputs"]}
+
+        jobs = self.jobs()
+        dash_encoder.plan_build(jobs, cache, "hash")
+        self.assertEqual([job["cached"] for job in jobs], [True, True, True])
+
+        jobs = self.jobs()
+        dash_encoder.plan_build(jobs, cache, "hash", force=True)
+        self.assertEqual([job["cached"] for job in jobs], [False, False, False])
+
+    def test_changes_propagate(self):
+        jobs = self.jobs()
+        dash_encoder.plan_build(jobs, {}, "hash")
+        cache = {output: job["key"] for job in jobs for output in job["outputs"]}
+
+        # a changed chunk command invalidates all jobs that depend on it
+        jobs = self.jobs(cmd="encode -crf 20")
+        dash_encoder.plan_build(jobs, cache, "hash")
+        self.assertEqual([job["cached"] for job in jobs], [False, False, False])
+
+        # a changed source invalidates everything
+        jobs = self.jobs()
+        dash_encoder.plan_build(jobs, cache, "other hash")
+        self.assertEqual([job["cached"] for job in jobs], [False, False, False])
+
+    def test_missing_output(self):
+        jobs = self.jobs()
+        dash_encoder.plan_build(jobs, {}, "hash")
+        cache = {output: job["key"] for job in jobs for output in job["outputs"]}
+        os.remove(jobs[2]["outputs"][0])
+
+        jobs = self.jobs()
+        os.remove(jobs[2]["outputs"][0])
+        dash_encoder.plan_build(jobs, cache, "hash")
+        self.assertEqual([job["cached"] for job in jobs], [True, True, False])
+
+
+class MergeRangesTest(unittest.TestCase):
+    def setUp(self):
+        try:
+            import dash_server
+        except Exception as e:
+            self.skipTest(f"dash_server can not be imported: {e}")
+        self.merge_ranges = dash_server.merge_ranges
+
+    def test_merge(self):
+        self.assertEqual(self.merge_ranges([]), [])
+        self.assertEqual(self.merge_ranges([(10, 20), (0, 5)]), [(0, 5), (10, 20)])
+        self.assertEqual(self.merge_ranges([(0, 10), (5, 20), (20, 30)]), [(0, 30)])
+        self.assertEqual(self.merge_ranges([(0, 100), (10, 20)]), [(0, 100)])
+
+
+class ConvexHullTest(unittest.TestCase):
+    def test_hull(self):
+        points = [
+            {"bitrate": 100, "quality": 0.80, "height": 240, "crf": 30},
+            {"bitrate": 200, "quality": 0.90, "height": 360, "crf": 30},
+            {"bitrate": 300, "quality": 0.88, "height": 240, "crf": 22},  # worse than a cheaper point
+            {"bitrate": 400, "quality": 0.91, "height": 576, "crf": 34},  # below the line 200 -> 800
+            {"bitrate": 800, "quality": 0.97, "height": 720, "crf": 26},
+        ]
+        hull = dash_encoder.convex_hull(points)
+        self.assertEqual([x["bitrate"] for x in hull], [100, 200, 800])
+        self.assertEqual(dash_encoder.select_rungs(hull, 2), {240: {"crf": 30}, 720: {"crf": 26}})
+
+    def test_single_point(self):
+        points = [{"bitrate": 100, "quality": 0.8, "height": 240, "crf": 30}]
+        self.assertEqual(dash_encoder.convex_hull(points), points)
+        self.assertEqual(dash_encoder.convex_hull([]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()